@@ -0,0 +1,90 @@
+import sys
+import os
+import json
+import time
+import tempfile
+import importlib.util
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from comfyui_setup_gui import generate_configured_script
+
+IMAGE_COUNT = 20
+IMAGE_SIZE = (1408, 1408)
+ROUNDS = 3
+
+def load_api_module(work_dir):
+    """Generate the mobile API script into work_dir and import it"""
+    output_dir = work_dir / "output"
+    output_dir.mkdir()
+    script_path = work_dir / "comfyui_mobile_api.py"
+    script_path.write_text(generate_configured_script(work_dir, output_dir), encoding="utf-8")
+
+    os.chdir(work_dir)
+    spec = importlib.util.spec_from_file_location("comfyui_mobile_api", script_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module, output_dir
+
+def make_outputs(output_dir):
+    """Write noisy 1408x1408 PNGs carrying ComfyUI-style prompt and workflow chunks"""
+    from PIL import Image, PngImagePlugin
+
+    prompt = {
+        "3": {"class_type": "KSampler", "inputs": {"seed": 1, "steps": 10, "cfg": 1.0,
+                                                   "sampler_name": "lcm", "scheduler": "beta"}},
+        "4": {"class_type": "CheckpointLoaderSimple", "inputs": {"ckpt_name": "model.safetensors"}},
+        "5": {"class_type": "EmptyLatentImage", "inputs": {"width": 1408, "height": 1408, "batch_size": 1}},
+        "6": {"class_type": "CLIPTextEncode", "inputs": {"text": "beautiful landscape, detailed, 4k"}},
+        "7": {"class_type": "CLIPTextEncode", "inputs": {"text": "low quality, blurry"}},
+    }
+    workflow = {"nodes": [{"id": i, "type": "Note", "widgets_values": ["x" * 200]} for i in range(200)]}
+
+    paths = []
+    for i in range(IMAGE_COUNT):
+        img = Image.frombytes("RGB", IMAGE_SIZE, os.urandom(IMAGE_SIZE[0] * IMAGE_SIZE[1] * 3))
+        info = PngImagePlugin.PngInfo()
+        info.add_text("prompt", json.dumps(prompt))
+        info.add_text("workflow", json.dumps(workflow))
+        path = output_dir / f"ComfyUI_{i:05}_.png"
+        img.save(path, pnginfo=info, compress_level=1)
+        paths.append(path)
+    return paths
+
+def time_reader(name, reader, paths):
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for path in paths:
+            reader(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    per_image = best / len(paths) * 1000
+    print(f"{name:28} {per_image:8.2f} ms/image")
+    return per_image
+
+def main():
+    print("=" * 60)
+    print("Metadata reader benchmark")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as temp:
+        api, output_dir = load_api_module(Path(temp))
+        paths = make_outputs(output_dir)
+        average_size = sum(p.stat().st_size for p in paths) / len(paths) / (1024 * 1024)
+        print(f"{len(paths)} PNG outputs, {IMAGE_SIZE[0]}x{IMAGE_SIZE[1]}, {average_size:.1f} MB each")
+        print(f"Best of {ROUNDS} rounds\n")
+
+        for path in paths:
+            if api.extract_metadata_from_image(path) != api.extract_metadata_with_pillow(path):
+                print(f"Mismatch between readers for {path.name}")
+                return 1
+
+        pillow = time_reader("Pillow (Image.open + text)", api.extract_metadata_with_pillow, paths)
+        header = time_reader("Header-only reader", api.extract_metadata_from_image, paths)
+        print(f"\nSpeedup: {pillow / header:.0f}x")
+        os.chdir(Path(__file__).resolve().parent)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
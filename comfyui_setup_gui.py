@@ -58,19 +58,56 @@ def generate_configured_script(comfyui_root, output_dir):
     
     script_content = f'''import asyncio
 import json
-import requests
+import httpx
+import websockets
 import uuid
 import os
+import sqlite3
+import threading
+import time
+import fnmatch
+import zlib
+import hashlib
+import mimetypes
+import queue
+import shutil
+import subprocess
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Response
+from urllib.parse import quote
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
-from pydantic import BaseModel
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field
 import uvicorn
 from typing import Optional, List
 import glob
+import gzip
+import re
 from PIL import Image
 from PIL.ExifTags import TAGS
+try:
+    import pillow_avif  # registers AVIF support on Pillow versions without it built in
+except ImportError:
+    pass
+try:
+    from watchdog.observers import Observer
+except ImportError:
+    Observer = None
+try:
+    import brotli  # precompresses the UI a little smaller than gzip when installed
+except ImportError:
+    brotli = None
+try:
+    import numpy as np
+    POPCOUNT_TABLE = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1, dtype=np.uint8)
+except ImportError:
+    np = None
 import base64
 from io import BytesIO
 
@@ -79,12 +116,113 @@ app = FastAPI(title="ComfyUI Mobile API")
 # Configuration - Auto-configured by setup script
 COMFYUI_HOST = "127.0.0.1"
 COMFYUI_PORT = 8188
+COMFYUI_URL = f"http://{{COMFYUI_HOST}}:{{COMFYUI_PORT}}"
+COMFYUI_MAX_CONNECTIONS = 20  # pooled keep-alive connections per backend, shared by every phone
+SSE_KEEPALIVE_INTERVAL = 15  # seconds between keep-alive comments on idle event streams
+QUEUE_POLL_ACTIVE_INTERVAL = 0.5  # seconds between queue/history snapshots while jobs run
+QUEUE_POLL_IDLE_INTERVAL = 5
+QUEUE_POLL_MIN_INTERVAL = 0.25
+QUEUE_HISTORY_ITEMS = 64  # finished prompts whose history entries are kept in memory
+CATALOG_TTL = 300  # seconds before /object_info is fetched again for the model catalog
+CATALOG_RETRY_INTERVAL = 15
 OUTPUT_DIR = Path("outputs")
 OUTPUT_DIR.mkdir(exist_ok=True)
 
 # ComfyUI Output Directory - Auto-detected
 COMFYUI_OUTPUT_DIR = Path(r"{output_dir}")
 
+# ComfyUI backends - each job goes to the least loaded reachable one that has its checkpoint
+# Add more boxes as "name": {{"url": "http://192.168.0.120:8188"}}; output_dir only for folders this PC can read
+COMFYUI_BACKENDS = {{
+    "local": {{"url": COMFYUI_URL, "output_dir": COMFYUI_OUTPUT_DIR}},
+}}
+
+# Gallery index - keeps path, mtime, size, dimensions and settings on disk
+# Roots are walked recursively; add more (a NAS mount, another output folder) as "name": Path(...)
+GALLERY_ROOTS = {{
+    "output": COMFYUI_OUTPUT_DIR,
+    "mobile": OUTPUT_DIR,
+}}
+# fnmatch patterns matched against each file or folder name and its path below the root
+GALLERY_EXCLUDE = ["mobile_cache", ".*", "__pycache__", "*.tmp"]
+# Longest root first so a root nested inside another one claims its own files
+GALLERY_ROOT_PATHS = sorted(((name, os.path.abspath(path)) for name, path in GALLERY_ROOTS.items()),
+                            key=lambda root: -len(root[1]))
+GALLERY_MEDIA_TYPES = {{
+    '.png': 'image/png', '.jpg': 'image/jpeg', '.jpeg': 'image/jpeg', '.webp': 'image/webp',
+    '.gif': 'image/gif', '.mp4': 'video/mp4', '.webm': 'video/webm', '.mov': 'video/quicktime'
+}}
+GALLERY_EXTENSIONS = set(GALLERY_MEDIA_TYPES)
+VIDEO_EXTENSIONS = {{'.mp4', '.webm', '.mov'}}  # shown through a poster frame, played with Range requests
+CACHE_DIR = Path("mobile_cache")
+CACHE_DIR.mkdir(exist_ok=True)
+GALLERY_DB_PATH = CACHE_DIR / "gallery.db"
+UI_ASSET_DIR = CACHE_DIR / "ui"  # minified, content-hashed CSS and JS of the page, rebuilt on start
+APP_ICON_SIZES = [192, 512]
+OFFLINE_THUMB_MAX_BYTES = 50 * 1024 * 1024  # thumbnails the installed app keeps on the phone
+# HTTPS certificate and key - phones only run the offline cache and offer "Install app" on a secure page
+SSL_CERTFILE = None
+SSL_KEYFILE = None
+GALLERY_RECONCILE_INTERVAL = 300  # seconds between full drift checks
+GALLERY_POLL_INTERVAL = 2  # seconds between folder checks when watchdog is not installed
+GALLERY_WATCH_DEBOUNCE = 0.5
+GALLERY_PAGE_MAX = 200
+METADATA_CACHE_PATH = CACHE_DIR / "metadata.db"
+# Perceptual hashes - distances are in differing bits out of 64, hashing needs numpy
+HASH_SIZE = 8
+HASH_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+SIMILAR_MAX_DISTANCE = 12  # default reach of "find similar"
+DUPLICATE_MAX_DISTANCE = 4  # images this close collapse into their newest one
+DUPLICATE_MERGE_BATCH = 1 << 20  # close pairs gathered before they are merged into groups
+METADATA_CACHE_MAX_ENTRIES = 200000
+
+# Thumbnail cache - rendered once per image version, oldest dropped past the size cap
+THUMB_CACHE_DIR = CACHE_DIR / "thumbs"
+THUMB_CACHE_MAX_BYTES = 512 * 1024 * 1024
+THUMB_WIDTHS = [160, 320, 480, 720]  # widths offered to the gallery through srcset
+THUMB_DEFAULT_WIDTH = 320
+THUMB_PREWARM = True  # render thumbnails for new outputs in the background
+THUMB_PREWARM_WORKERS = min(61, os.cpu_count() or 2)
+THUMB_PREWARM_QUEUE = 256
+THUMB_PREWARM_FORMATS = ["webp"]  # formats rendered ahead of time at every width
+POSTER_DIR = CACHE_DIR / "posters"
+POSTER_DIR.mkdir(exist_ok=True)
+FFMPEG = shutil.which("ffmpeg")  # poster frames for videos; a placeholder is drawn without it
+VIDEO_POSTER_TIMEOUT = 30
+THUMB_PREWARM_LOW_PRIORITY = True  # run workers at idle priority so ComfyUI is never starved
+
+# Job store - finished jobs expire, everything is journaled so restarts keep job ids
+JOBS_JOURNAL_PATH = CACHE_DIR / "jobs.jsonl"
+JOB_MAX_ENTRIES = 500
+JOB_TTL = 6 * 3600  # seconds a finished job stays available
+JOB_STALE_AGE = 24 * 3600  # unfinished jobs older than this are given up on
+COMFYUI_CLIENT_ID_PATH = CACHE_DIR / "client_id"
+
+# Live previews - ComfyUI only sends them when started with --preview-method auto (or taesd)
+PREVIEW_FPS = 2  # frames per second pushed to each phone, 0 turns previews off
+PREVIEW_MAX_SIZE = 256
+PREVIEW_QUALITY = 70
+
+# Batch generation - variations share one latent batch up to BATCH_MAX_LATENT images
+BATCH_MAX_IMAGES = 64
+BATCH_MAX_LATENT = 4  # larger batches are split so a phone request can't exhaust VRAM
+
+# Workflow templates - API-format workflow JSON plus bindings to request fields
+TEMPLATES_DIR = Path("workflow_templates")
+TEMPLATES_DIR.mkdir(exist_ok=True)
+
+# Thumbnail encodings, best first - AVIF and WebP only when this Pillow build can write them
+Image.init()
+THUMB_FORMATS = {{
+    "jpeg": {{"media_type": "image/jpeg", "suffix": ".jpg", "save": {{"format": "JPEG", "quality": 85}}}},
+}}
+if "WEBP" in Image.SAVE:
+    THUMB_FORMATS["webp"] = {{"media_type": "image/webp", "suffix": ".webp",
+                             "save": {{"format": "WEBP", "quality": 80, "method": 4}}}}
+if "AVIF" in Image.SAVE:
+    THUMB_FORMATS["avif"] = {{"media_type": "image/avif", "suffix": ".avif",
+                             "save": {{"format": "AVIF", "quality": 60, "speed": 8}}}}
+
 class GenerateRequest(BaseModel):
     prompt: str
     negative_prompt: Optional[str] = ""
@@ -97,49 +235,285 @@ class GenerateRequest(BaseModel):
     model: str = "mopMixtureOfPerverts_v31.safetensors"
     clip_skip: int = -2
     seed: int = -1
+    template: Optional[str] = None  # workflow template name, the built-in txt2img graph by default
+
+class BatchRequest(GenerateRequest):
+    prompts: List[str] = []  # one set of images per prompt, defaults to [prompt]
+    batch_size: int = Field(1, le=BATCH_MAX_IMAGES)  # images per prompt and seed
+    seed_count: int = Field(0, le=BATCH_MAX_IMAGES)  # when > 1, queue seeds seed, seed+1, ... as separate prompts
+
+PNG_SIGNATURE = bytes([137, 80, 78, 71, 13, 10, 26, 10])
+MAX_METADATA_CHUNK = 64 * 1024 * 1024
+EXIF_USER_COMMENT = 0x9286
+EXIF_IFD_POINTER = 0x8769
+TIFF_TYPE_SIZES = {{1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 7: 1, 9: 4, 10: 8, 11: 4, 12: 8}}
+JPEG_SOF_MARKERS = {{0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}}
+
+def read_image_header(image_path):
+    """Read dimensions, text chunks and EXIF tags without decoding any pixels.
+
+    Returns {{"width", "height", "text", "exif"}} or None for formats it does not know.
+    """
+    with open(image_path, 'rb') as f:
+        magic = f.read(12)
+        f.seek(0)
+        if magic[:8] == PNG_SIGNATURE:
+            return read_png_header(f)
+        if magic[:4] == b'RIFF' and magic[8:12] == b'WEBP':
+            return read_webp_header(f)
+        if magic[:2] == b'\\xff\\xd8':
+            return read_jpeg_header(f)
+    return None
+
+def read_png_header(f):
+    header = {{"width": None, "height": None, "text": {{}}, "exif": {{}}}}
+    f.seek(8)
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            break
+        length = int.from_bytes(chunk[:4], 'big')
+        chunk_type = chunk[4:8]
+
+        if chunk_type == b'IHDR':
+            data = f.read(length)
+            header["width"] = int.from_bytes(data[0:4], 'big')
+            header["height"] = int.from_bytes(data[4:8], 'big')
+        elif chunk_type in (b'tEXt', b'zTXt', b'iTXt') and length <= MAX_METADATA_CHUNK:
+            key, value = parse_png_text_chunk(chunk_type, f.read(length))
+            if key and key not in header["text"]:
+                header["text"][key] = value
+        elif chunk_type == b'eXIf' and length <= MAX_METADATA_CHUNK:
+            header["exif"].update(parse_tiff_tags(f.read(length)))
+        elif chunk_type == b'IDAT' and header["text"]:
+            # ComfyUI writes its text chunks ahead of the pixel data
+            break
+        elif chunk_type == b'IEND':
+            break
+        else:
+            f.seek(length, 1)
+        f.seek(4, 1)  # CRC
+    return header
+
+def parse_png_text_chunk(chunk_type, data):
+    try:
+        key, _, rest = data.partition(b'\\x00')
+        key = key.decode('latin-1')
+        if chunk_type == b'tEXt':
+            return key, rest.decode('latin-1')
+        if chunk_type == b'zTXt':
+            return key, zlib.decompress(rest[1:]).decode('latin-1')
+        compressed = rest[0]
+        _language, _, rest = rest[2:].partition(b'\\x00')
+        _translated, _, text = rest.partition(b'\\x00')
+        if compressed:
+            text = zlib.decompress(text)
+        return key, text.decode('utf-8')
+    except Exception:
+        return None, None
+
+def read_webp_header(f):
+    header = {{"width": None, "height": None, "text": {{}}, "exif": {{}}}}
+    riff_end = 8 + int.from_bytes(f.read(12)[4:8], 'little')
+    wanted = {{b'EXIF', b'XMP '}}
+    while f.tell() + 8 <= riff_end and wanted:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            break
+        fourcc = chunk[:4]
+        length = int.from_bytes(chunk[4:8], 'little')
+        padded = length + (length & 1)
+
+        if fourcc == b'VP8X':
+            data = f.read(padded)
+            header["width"] = int.from_bytes(data[4:7], 'little') + 1
+            header["height"] = int.from_bytes(data[7:10], 'little') + 1
+            # Flags say up front whether EXIF or XMP chunks exist at all
+            if not data[0] & 0x08:
+                wanted.discard(b'EXIF')
+            if not data[0] & 0x04:
+                wanted.discard(b'XMP ')
+        elif fourcc == b'VP8 ' and header["width"] is None:
+            data = f.read(min(padded, 10))
+            f.seek(padded - len(data), 1)
+            header["width"] = int.from_bytes(data[6:8], 'little') & 0x3FFF
+            header["height"] = int.from_bytes(data[8:10], 'little') & 0x3FFF
+        elif fourcc == b'VP8L' and header["width"] is None:
+            data = f.read(min(padded, 5))
+            f.seek(padded - len(data), 1)
+            bits = int.from_bytes(data[1:5], 'little')
+            header["width"] = (bits & 0x3FFF) + 1
+            header["height"] = ((bits >> 14) & 0x3FFF) + 1
+        elif fourcc == b'EXIF' and length <= MAX_METADATA_CHUNK:
+            data = f.read(padded)[:length]
+            if data.startswith(b'Exif\\x00\\x00'):
+                data = data[6:]
+            header["exif"].update(parse_tiff_tags(data))
+            wanted.discard(b'EXIF')
+        elif fourcc == b'XMP ' and length <= MAX_METADATA_CHUNK:
+            header["text"]["xmp"] = f.read(padded)[:length].decode('utf-8', errors='ignore')
+            wanted.discard(b'XMP ')
+        else:
+            f.seek(padded, 1)
+    return header
+
+def read_jpeg_header(f):
+    header = {{"width": None, "height": None, "text": {{}}, "exif": {{}}}}
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            break
+        code = marker[1]
+        if code == 0xFF:
+            f.seek(-1, 1)  # fill byte
+            continue
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue
+        if code in (0xD9, 0xDA):
+            # End of image or start of scan - everything after is pixel data
+            break
+        length = int.from_bytes(f.read(2), 'big') - 2
+        if length < 0:
+            break
+
+        if code == 0xE1 and length <= MAX_METADATA_CHUNK:
+            data = f.read(length)
+            if data.startswith(b'Exif\\x00\\x00'):
+                header["exif"].update(parse_tiff_tags(data[6:]))
+            elif data.startswith(b'http://ns.adobe.com/xap/1.0/\\x00'):
+                header["text"]["xmp"] = data.split(b'\\x00', 1)[1].decode('utf-8', errors='ignore')
+        elif code in JPEG_SOF_MARKERS:
+            data = f.read(length)
+            header["height"] = int.from_bytes(data[1:3], 'big')
+            header["width"] = int.from_bytes(data[3:5], 'big')
+        else:
+            f.seek(length, 1)
+    return header
+
+def parse_tiff_tags(data):
+    """Return {{tag: raw bytes}} for the byte/ascii/undefined tags of IFD0 and the Exif IFD"""
+    tags = {{}}
+    if len(data) < 8 or data[:2] not in (b'II', b'MM'):
+        return tags
+    order = 'little' if data[:2] == b'II' else 'big'
+
+    def read_ifd(offset, follow_exif):
+        if offset + 2 > len(data):
+            return
+        count = int.from_bytes(data[offset:offset + 2], order)
+        for i in range(count):
+            entry = data[offset + 2 + i * 12:offset + 14 + i * 12]
+            if len(entry) < 12:
+                return
+            tag = int.from_bytes(entry[0:2], order)
+            value_type = int.from_bytes(entry[2:4], order)
+            value_count = int.from_bytes(entry[4:8], order)
+            if tag == EXIF_IFD_POINTER and follow_exif:
+                read_ifd(int.from_bytes(entry[8:12], order), False)
+                continue
+            if value_type not in (1, 2, 7):
+                continue
+            size = value_count * TIFF_TYPE_SIZES[value_type]
+            if size <= 4:
+                tags[tag] = entry[8:8 + size]
+            else:
+                start = int.from_bytes(entry[8:12], order)
+                tags[tag] = data[start:start + size]
+
+    read_ifd(int.from_bytes(data[4:8], order), True)
+    return tags
+
+def decode_user_comment(value):
+    """Decode an EXIF UserComment, honouring its 8 byte character code prefix"""
+    if isinstance(value, str):
+        return value
+    prefix, body = value[:8], value[8:]
+    if prefix == b'UNICODE\\x00':
+        encoding = 'utf-16-le' if body[:2] == b'\\xff\\xfe' or (len(body) > 1 and body[1] == 0) else 'utf-16-be'
+        return body.decode(encoding, errors='ignore').lstrip('\\ufeff')
+    if prefix in (b'ASCII\\x00\\x00\\x00', b'\\x00' * 8):
+        return body.decode('utf-8', errors='ignore')
+    return value.decode('utf-8', errors='ignore')
+
+def settings_from_metadata(text, user_comment=None):
+    """Turn text chunks or an EXIF UserComment into the gallery settings dict"""
+    if text:
+        # Check for prompt in text chunks
+        if 'prompt' in text:
+            try:
+                prompt_data = json.loads(text['prompt'])
+                return extract_from_prompt_json(prompt_data)
+            except:
+                pass
+
+        # Check for workflow
+        if 'workflow' in text:
+            try:
+                workflow_data = json.loads(text['workflow'])
+                return extract_from_workflow_json(workflow_data)
+            except:
+                pass
+
+        # Check for A1111 style parameters
+        if 'parameters' in text:
+            return parse_a1111_parameters(text['parameters'])
+
+    if user_comment:
+        value = decode_user_comment(user_comment).strip('\\x00 ')
+        try:
+            settings = json.loads(value)
+        except:
+            if 'Steps:' in value:
+                return parse_a1111_parameters(value)
+        else:
+            # Only a JSON object holds settings - a bare list, string or number is ignored
+            if isinstance(settings, dict):
+                return settings
+
+    return None
 
 def extract_metadata_from_image(image_path):
-    """Extract ComfyUI metadata from image - improved version"""
+    """Extract ComfyUI metadata from image headers without decoding pixels"""
+    try:
+        header = read_image_header(image_path)
+        if header is not None:
+            return settings_from_header(header)
+    except Exception as e:
+        print(f"Error reading metadata headers from {{image_path}}: {{e}}")
+    return extract_metadata_with_pillow(image_path)
+
+def settings_from_header(header):
+    text = dict(header["text"])
+    # ComfyUI's WebP savers store "prompt:{{...}}" and "workflow:{{...}}" in ASCII EXIF tags
+    for value in header["exif"].values():
+        key, sep, rest = value.partition(b':')
+        key = key.decode('latin-1', errors='ignore').lower()
+        if sep and key in ('prompt', 'workflow') and key not in text:
+            text[key] = rest.rstrip(b'\\x00').decode('utf-8', errors='ignore')
+    return settings_from_metadata(text, header["exif"].get(EXIF_USER_COMMENT))
+
+def extract_metadata_with_pillow(image_path):
+    """Extract ComfyUI metadata through Pillow - used for formats the header reader does not know"""
     try:
         with Image.open(image_path) as img:
             # Try PNG text chunks first (ComfyUI's preferred method)
-            if hasattr(img, 'text') and img.text:
-                # Check for prompt in text chunks
-                if 'prompt' in img.text:
-                    try:
-                        prompt_data = json.loads(img.text['prompt'])
-                        return extract_from_prompt_json(prompt_data)
-                    except:
-                        pass
-                
-                # Check for workflow
-                if 'workflow' in img.text:
-                    try:
-                        workflow_data = json.loads(img.text['workflow'])
-                        return extract_from_workflow_json(workflow_data)
-                    except:
-                        pass
-                
-                # Check for A1111 style parameters
-                if 'parameters' in img.text:
-                    return parse_a1111_parameters(img.text['parameters'])
-            
+            text = img.text if hasattr(img, 'text') else None
+
             # Try EXIF as fallback
+            user_comment = None
             exif = img.getexif()
             if exif:
                 for tag_id, value in exif.items():
                     tag_name = TAGS.get(tag_id, tag_id)
                     if tag_name == 'UserComment' and value:
-                        try:
-                            if isinstance(value, bytes):
-                                value = value.decode('utf-8', errors='ignore')
-                            return json.loads(value)
-                        except:
-                            pass
-                            
+                        user_comment = value
+
+            return settings_from_metadata(text, user_comment)
+
     except Exception as e:
         print(f"Error extracting metadata from {{image_path}}: {{e}}")
-    
+
     return None
 
 def extract_from_prompt_json(prompt_data):
@@ -302,86 +676,1637 @@ def parse_a1111_parameters(params_str):
         print(f"Error parsing A1111 parameters: {{e}}")
         return None
 
-def create_workflow(params: GenerateRequest):
-    seed = params.seed if params.seed != -1 else int.from_bytes(os.urandom(4), 'big')
-    
-    workflow = {{
-        "6": {{
-            "inputs": {{
-                "text": params.prompt,
-                "clip": ["11", 1]
-            }},
-            "class_type": "CLIPTextEncode",
-            "_meta": {{"title": "CLIP Text Encode (Prompt)"}}
+def read_image_metadata(image_path):
+    """Read (width, height, settings) straight from the image file headers"""
+    if is_video(image_path):
+        return None, None, {{}}
+    try:
+        header = read_image_header(image_path)
+        if header is not None and header["width"]:
+            return header["width"], header["height"], settings_from_header(header)
+    except Exception as e:
+        print(f"Error reading metadata headers from {{image_path}}: {{e}}")
+
+    width = height = None
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+    except Exception:
+        pass
+    return width, height, extract_metadata_with_pillow(image_path)
+
+class MetadataCache:
+    """Persistent LRU cache of parsed image metadata keyed by (path, size, mtime).
+
+    Outlives gallery index rebuilds, so re-indexing an unchanged file costs no image I/O.
+    """
+
+    def __init__(self, db_path, max_entries):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS metadata (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL,
+                size INTEGER NOT NULL,
+                width INTEGER,
+                height INTEGER,
+                settings TEXT,
+                used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS metadata_by_use ON metadata (used);
+        """)
+        self.entries = self.conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+
+    def lookup(self, path, mtime, size):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT mtime, size, width, height, settings FROM metadata WHERE path = ?", (path,)
+            ).fetchone()
+            if row and row[0] == mtime and row[1] == size:
+                with self.conn:
+                    self.conn.execute("UPDATE metadata SET used = ? WHERE path = ?", (time.time(), path))
+                return row[2], row[3], json.loads(row[4]) if row[4] else None
+
+        width, height, settings = read_image_metadata(path)
+        self.store(path, mtime, size, width, height, settings)
+        return width, height, settings
+
+    def store(self, path, mtime, size, width, height, settings):
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO metadata (path, mtime, size, width, height, settings, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, mtime, size, width, height, json.dumps(settings) if settings else None, time.time())
+            )
+            self.entries += 1
+            if self.entries > self.max_entries * 1.1:
+                # Evict in bulk so the cap check is not paid on every insert
+                self.conn.execute(
+                    "DELETE FROM metadata WHERE path IN "
+                    "(SELECT path FROM metadata ORDER BY used LIMIT "
+                    "(SELECT MAX(COUNT(*) - ?, 0) FROM metadata))",
+                    (self.max_entries,)
+                )
+                self.entries = self.conn.execute("SELECT COUNT(*) FROM metadata").fetchone()[0]
+
+metadata_cache = None
+
+GALLERY_SCHEMA_VERSION = 4
+GALLERY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    settings TEXT,
+    prompt TEXT,
+    negative_prompt TEXT,
+    model TEXT,
+    sampler TEXT,
+    scheduler TEXT,
+    steps INTEGER,
+    cfg REAL,
+    phash INTEGER,
+    indexed INTEGER NOT NULL DEFAULT 0,
+    hashed INTEGER NOT NULL DEFAULT 0,
+    seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS images_by_mtime ON images (mtime DESC, path DESC);
+CREATE INDEX IF NOT EXISTS images_by_name ON images (name);
+CREATE INDEX IF NOT EXISTS images_pending ON images (indexed);
+CREATE INDEX IF NOT EXISTS images_unhashed ON images (hashed, mtime);
+CREATE INDEX IF NOT EXISTS images_by_seq ON images (seq);
+CREATE TABLE IF NOT EXISTS deleted (
+    path TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS deleted_by_seq ON deleted (seq);
+"""
+
+# Full-text index over the prompt columns, kept in step with images by triggers.
+# External content, so the text itself is stored only once.
+GALLERY_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS images_fts USING fts5(
+    prompt, negative_prompt, model, content='images', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS images_fts_insert AFTER INSERT ON images BEGIN
+    INSERT INTO images_fts (rowid, prompt, negative_prompt, model)
+    VALUES (new.rowid, new.prompt, new.negative_prompt, new.model);
+END;
+CREATE TRIGGER IF NOT EXISTS images_fts_delete AFTER DELETE ON images BEGIN
+    INSERT INTO images_fts (images_fts, rowid, prompt, negative_prompt, model)
+    VALUES ('delete', old.rowid, old.prompt, old.negative_prompt, old.model);
+END;
+CREATE TRIGGER IF NOT EXISTS images_fts_update AFTER UPDATE OF prompt, negative_prompt, model ON images BEGIN
+    INSERT INTO images_fts (images_fts, rowid, prompt, negative_prompt, model)
+    VALUES ('delete', old.rowid, old.prompt, old.negative_prompt, old.model);
+    INSERT INTO images_fts (rowid, prompt, negative_prompt, model)
+    VALUES (new.rowid, new.prompt, new.negative_prompt, new.model);
+END;
+"""
+
+# key:value filters understood by the gallery search box
+SEARCH_RANGE_FIELDS = {{"steps": "steps", "cfg": "cfg", "width": "width", "height": "height"}}
+SEARCH_MATCH_FIELDS = {{"sampler": "sampler", "scheduler": "scheduler"}}
+SEARCH_SORT_LIMIT = 2000  # up to this many full-text hits are sorted, beyond it the mtime index is walked
+
+def search_columns(settings):
+    """(prompt, negative_prompt, model, sampler, scheduler, steps, cfg) for the searchable columns"""
+    settings = settings or {{}}
+
+    def text(key):
+        value = settings.get(key)
+        return value if isinstance(value, str) and value else None
+
+    def number(key, kind):
+        try:
+            return kind(settings[key])
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    return (text("prompt"), text("negative_prompt"), text("model"), text("sampler"),
+            text("scheduler"), number("steps", int), number("cfg_scale", float))
+
+def like_pattern(text):
+    """LIKE pattern matching text anywhere, with its own % and _ taken literally"""
+    return "%" + text.replace("\\\\", "\\\\\\\\").replace("%", "\\\\%").replace("_", "\\\\_") + "%"
+
+def parse_number_range(value):
+    """'20' -> (20, 20), '20-30' -> (20, 30), '>20' -> (20, None), '<30' -> (None, 30)"""
+    if value.startswith((">", "<")):
+        number = float(value.lstrip("<>="))
+        return (number, None) if value[0] == ">" else (None, number)
+    if "-" in value:
+        low, high = value.split("-", 1)
+        return float(low), float(high)
+    number = float(value)
+    return number, number
+
+def parse_search_query(query):
+    """Split a search box query into (prompt words, negative words, [(sql, params)] filters).
+
+    Plain words search the prompt and model name; neg:word searches negative prompts;
+    model:, sampler:, scheduler:, steps:, cfg:, width: and height: filter, numbers
+    taking 20, 20-30, >20 or <30.
+    """
+    words, negative, filters = [], [], []
+    for token in query.split():
+        key, sep, value = token.partition(":")
+        key = key.lower()
+        if not sep or not value:
+            words.append(token)
+        elif key in ("neg", "negative"):
+            negative.append(value)
+        elif key == "model":
+            filters.append(("model LIKE ? ESCAPE '\\\\'", [like_pattern(value)]))
+        elif key in SEARCH_MATCH_FIELDS:
+            filters.append((f"{{SEARCH_MATCH_FIELDS[key]}} = ? COLLATE NOCASE", [value]))
+        elif key in SEARCH_RANGE_FIELDS:
+            try:
+                low, high = parse_number_range(value)
+            except ValueError:
+                words.append(token)
+                continue
+            column = SEARCH_RANGE_FIELDS[key]
+            if low is not None:
+                filters.append((f"{{column}} >= ?", [low]))
+            if high is not None:
+                filters.append((f"{{column}} <= ?", [high]))
+        else:
+            words.append(token)
+    return words, negative, filters
+
+def fts_query(words, columns):
+    """FTS5 query matching every word as a prefix within the given columns"""
+    terms = " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+    return "{{" + " ".join(columns) + "}}: (" + terms + ")"
+
+def is_gallery_file(path):
+    return os.path.splitext(path)[1].lower() in GALLERY_EXTENSIONS
+
+def is_video(path):
+    return os.path.splitext(str(path))[1].lower() in VIDEO_EXTENSIONS
+
+def gallery_media_type(path):
+    # Explicit table first - on Windows mimetypes reads the registry, which is often wrong
+    return GALLERY_MEDIA_TYPES.get(os.path.splitext(str(path))[1].lower()) or mimetypes.guess_type(str(path))[0]
+
+def is_excluded(name, relative):
+    """Whether a file or folder matches GALLERY_EXCLUDE by its name or its path below the root"""
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative, pattern) for pattern in GALLERY_EXCLUDE)
+
+def is_excluded_path(relative):
+    """Whether any folder or file along a "/"-separated relative path is excluded"""
+    parts = relative.split("/")
+    return any(is_excluded(part, "/".join(parts[:i + 1])) for i, part in enumerate(parts))
+
+def gallery_id(path):
+    """Safe "<root name>/<relative path>" id for a file under a gallery root, None if outside or excluded"""
+    for name, root in GALLERY_ROOT_PATHS:
+        if path.startswith(root + os.sep):
+            relative = path[len(root) + 1:].replace(os.sep, "/")
+            return None if is_excluded_path(relative) else f"{{name}}/{{relative}}"
+    return None
+
+def resolve_gallery_id(image_id):
+    """Path of the gallery file an id names, or None if it is malformed, excluded or escapes its root"""
+    root_name, _, relative = image_id.partition("/")
+    if not relative:
+        # Bare filenames from before ids existed - only the top level of each root
+        if not image_id or any(c in image_id for c in '\\\\/:') or image_id in (".", ".."):
+            return None
+        candidates = [(root, image_id) for name, root in GALLERY_ROOT_PATHS]
+    else:
+        root = dict(GALLERY_ROOT_PATHS).get(root_name)
+        parts = relative.split("/")
+        if root is None or any(part in ("", ".", "..") for part in parts) or any(c in relative for c in '\\\\:'):
+            return None
+        candidates = [(root, relative)]
+
+    for root, relative in candidates:
+        path = os.path.join(root, *relative.split("/"))
+        if not is_gallery_file(path) or is_excluded_path(relative) or not os.path.isfile(path):
+            continue
+        # A symlink inside the root must not lead outside it
+        if not os.path.realpath(path).startswith(os.path.realpath(root) + os.sep):
+            continue
+        return Path(path)
+    return None
+
+def scan_gallery_dir(directory, relative=""):
+    """List one folder: ({{path: (mtime, size)}} of gallery files, [(subfolder, relative path)])"""
+    found = {{}}
+    subdirs = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                entry_relative = f"{{relative}}/{{entry.name}}" if relative else entry.name
+                try:
+                    # Symlinked folders are not followed, so link loops can't trap the walker
+                    if entry.is_dir(follow_symlinks=False):
+                        if not is_excluded(entry.name, entry_relative):
+                            subdirs.append((entry.path, entry_relative))
+                        continue
+                    if not is_gallery_file(entry.name) or is_excluded(entry.name, entry_relative):
+                        continue
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                found[entry.path] = (stat.st_mtime, stat.st_size)
+    except OSError as e:
+        print(f"Error scanning {{directory}}: {{e}}")
+    return found, subdirs
+
+def scan_gallery_tree(directory, relative="", folders=None):
+    """Return {{path: (mtime, size)}} for every gallery file below directory.
+
+    Walks iteratively with os.scandir, which hands back file types with the
+    listing, so only gallery files are ever stat'ed. When folders is given it
+    collects {{folder: (mtime, relative path, files)}} for the polling watcher.
+    """
+    found = {{}}
+    stack = [(directory, relative)]
+    while stack:
+        folder, folder_relative = stack.pop()
+        try:
+            mtime = os.stat(folder).st_mtime
+        except OSError:
+            continue
+        files, subdirs = scan_gallery_dir(folder, folder_relative)
+        found.update(files)
+        if folders is not None:
+            folders[folder] = (mtime, folder_relative, files)
+        stack.extend(subdirs)
+    return found
+
+class GalleryIndex:
+    """On-disk index of gallery images so pages never glob or stat the output folders"""
+
+    def __init__(self, db_path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != GALLERY_SCHEMA_VERSION:
+            # The index is only a cache of the folders, so an old layout is simply rebuilt
+            self.conn.executescript(
+                "DROP TABLE IF EXISTS images_fts; DROP TABLE IF EXISTS images; DROP TABLE IF EXISTS deleted;")
+            self.conn.execute(f"PRAGMA user_version = {{GALLERY_SCHEMA_VERSION}}")
+        self.conn.executescript(GALLERY_SCHEMA)
+        try:
+            self.conn.executescript(GALLERY_FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            # SQLite builds without FTS5 fall back to LIKE scans over the same columns
+            print(f"Gallery search: full-text index unavailable ({{e}}), using plain matching")
+            self.fts = False
+        self.seq = self.conn.execute(
+            "SELECT MAX(seq) FROM (SELECT MAX(seq) AS seq FROM images UNION ALL SELECT MAX(seq) FROM deleted)"
+        ).fetchone()[0] or 0
+        self.hashes_written = 0
+
+    def scan_files(self):
+        """Return {{path: (mtime, size)}} for every gallery file under every root"""
+        found = {{}}
+        for name, root in GALLERY_ROOT_PATHS:
+            if os.path.isdir(root):
+                found.update(scan_gallery_tree(root))
+        return found
+
+    def reconcile(self):
+        """Bring the index in line with the folders, then fill in missing metadata"""
+        on_disk = self.scan_files()
+        with self.lock:
+            indexed = {{row["path"]: (row["mtime"], row["size"])
+                       for row in self.conn.execute("SELECT path, mtime, size FROM images")}}
+
+        changed = [(path, mtime, size) for path, (mtime, size) in on_disk.items()
+                   if indexed.get(path) != (mtime, size)]
+        removed = [path for path in indexed if path not in on_disk]
+
+        with self.lock, self.conn:
+            self.store(changed)
+            self.forget(removed)
+
+        if changed or removed:
+            print(f"Gallery index: {{len(changed)}} added/changed, {{len(removed)}} removed, {{len(on_disk)}} total")
+
+        self.backfill()
+
+    def store(self, files):
+        """Insert or reset rows for [(path, mtime, size)]; caller holds the lock"""
+        for path, mtime, size in files:
+            self.seq += 1
+            # An upsert keeps the rowid, which the full-text index is keyed on
+            self.conn.execute(
+                "INSERT INTO images (path, name, mtime, size, indexed, seq) VALUES (?, ?, ?, ?, 0, ?) "
+                "ON CONFLICT(path) DO UPDATE SET mtime = excluded.mtime, size = excluded.size, "
+                "indexed = 0, hashed = 0, phash = NULL, seq = excluded.seq",
+                (path, os.path.basename(path), mtime, size, self.seq)
+            )
+            self.conn.execute("DELETE FROM deleted WHERE path = ?", (path,))
+
+    def forget(self, paths):
+        """Drop rows and leave tombstones for clients syncing deltas; caller holds the lock"""
+        for path in paths:
+            self.seq += 1
+            self.conn.execute("DELETE FROM images WHERE path = ?", (path,))
+            self.conn.execute("INSERT OR REPLACE INTO deleted (path, seq) VALUES (?, ?)", (path, self.seq))
+
+    def update_file(self, path):
+        """Apply a single added, changed or deleted file reported by the watcher"""
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+            exists = os.path.isfile(path)
+        except OSError:
+            exists = False
+
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT mtime, size FROM images WHERE path = ?", (path,)).fetchone()
+            if not exists:
+                if row:
+                    self.forget([path])
+                return False
+            if row and (row["mtime"], row["size"]) == (stat.st_mtime, stat.st_size):
+                return False
+            self.store([(path, stat.st_mtime, stat.st_size)])
+
+        self.index_file(path, stat.st_mtime, stat.st_size)
+        return True
+
+    def backfill(self, batch=64):
+        """Extract dimensions and settings for rows that have not been read yet, newest first"""
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT path, mtime, size FROM images WHERE indexed = 0 ORDER BY mtime DESC LIMIT ?",
+                    (batch,)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                self.index_file(row["path"], row["mtime"], row["size"])
+
+    def index_file(self, path, mtime, size):
+        try:
+            width, height, settings = metadata_cache.lookup(path, mtime, size)
+            if not isinstance(settings, dict):
+                settings = None
+            columns = search_columns(settings)
+        except Exception as e:
+            # Indexed without metadata, so one odd file can't hold up the gallery or the backfill
+            print(f"Could not index {{path}}: {{e}}")
+            width, height, settings = None, None, None
+            columns = search_columns(None)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE images SET width = ?, height = ?, settings = ?, prompt = ?, negative_prompt = ?, "
+                "model = ?, sampler = ?, scheduler = ?, steps = ?, cfg = ?, indexed = 1 WHERE path = ?",
+                (width, height, json.dumps(settings) if settings else None, *columns, path)
+            )
+        return width, height, settings
+
+    def unhashed(self, limit):
+        """[(path, mtime, size)] still waiting for a perceptual hash, newest first"""
+        with self.lock:
+            return [tuple(row) for row in self.conn.execute(
+                "SELECT path, mtime, size FROM images WHERE hashed = 0 ORDER BY mtime DESC LIMIT ?", (limit,))]
+
+    def set_hash(self, path, mtime, size, phash):
+        """Record a hash, or None for a file that could not be decoded, unless the file changed meanwhile"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "UPDATE images SET phash = ?, hashed = 1 WHERE path = ? AND mtime = ? AND size = ?",
+                (phash, path, mtime, size)
+            )
+            self.hashes_written += 1
+
+    def hash_of(self, path):
+        """(rowid, phash) of an indexed file, hashing it now if the background pass has not yet"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT rowid, mtime, size, phash, hashed FROM images WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return None
+        if row["hashed"]:
+            return row["rowid"], row["phash"]
+        try:
+            phash = image_dhash(path)
+        except Exception as e:
+            print(f"Could not hash {{path}}: {{e}}")
+            phash = None
+        self.set_hash(path, row["mtime"], row["size"], phash)
+        return row["rowid"], phash
+
+    def hash_version(self):
+        """Changes whenever a row or a hash does"""
+        return self.seq, self.hashes_written
+
+    def all_hashes(self):
+        """Parallel lists of rowid, mtime, path and phash for every row, newest first"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.row_factory = None
+            rows = cursor.execute(
+                "SELECT rowid, mtime, path, phash FROM images ORDER BY mtime DESC, path DESC").fetchall()
+        if not rows:
+            return [], [], [], []
+        return [list(column) for column in zip(*rows)]
+
+    def rows_by_id(self, rowids, counts=None):
+        """Entries for rowids in the given order, with group sizes attached when counts is given"""
+        if not rowids:
+            return []
+        with self.lock:
+            rows = {{row["rowid"]: row for row in self.conn.execute(
+                f"SELECT rowid, * FROM images WHERE rowid IN ({{','.join('?' * len(rowids))}})", rowids)}}
+        # Rows deleted since the hashes were loaded are simply left out
+        present = [rowid for rowid in rowids if rowid in rows]
+        images = self.entries([rows[rowid] for rowid in present])
+        if counts is not None:
+            sizes = dict(zip(rowids, counts))
+            for image, rowid in zip(images, present):
+                image["duplicates"] = sizes[rowid] - 1
+        return images
+
+    def collapsed_page(self, hashes, after, limit):
+        """Like page, showing only the newest image of each group of near-duplicates"""
+        page, last = hashes.collapsed_page(after, limit)
+        return self.rows_by_id([rowid for rowid, _ in page], [count for _, count in page]), last
+
+    def paths_under(self, directory):
+        """Indexed paths below a folder"""
+        prefix = directory.rstrip(os.sep) + os.sep
+        with self.lock:
+            return [row["path"] for row in self.conn.execute(
+                "SELECT path FROM images WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))]
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM images").fetchone()[0]
+
+    def page(self, after, limit):
+        """Up to limit entries older than the (mtime, path) key after, newest first.
+
+        Seeks straight into images_by_mtime, so a deep page costs the same as the
+        first and files added meanwhile never shift what comes next.
+        Returns (entries, key of the last row or None when nothing follows).
+        """
+        return self.select_page([], [], after, limit)
+
+    def search_conditions(self, query, ordered=True):
+        """SQL conditions and parameters for a search box query"""
+        words, negative, filters = parse_search_query(query)
+        conditions = [sql for sql, _ in filters]
+        params = [value for _, values in filters for value in values]
+        for targets, terms in ((("prompt", "model"), words), (("negative_prompt",), negative)):
+            if not terms:
+                continue
+            if self.fts:
+                match = fts_query(terms, targets)
+                # Few hits are fetched by rowid and sorted. For many, the unary + keeps SQLite
+                # walking images_by_mtime and testing rows against the hits, stopping after a page
+                common = ordered and self.match_count(match, SEARCH_SORT_LIMIT) >= SEARCH_SORT_LIMIT
+                conditions.append(("+rowid" if common else "rowid") +
+                                  " IN (SELECT rowid FROM images_fts WHERE images_fts MATCH ?)")
+                params.append(match)
+            else:
+                for term in terms:
+                    conditions.append("(" + " OR ".join(f"{{column}} LIKE ? ESCAPE '\\\\'" for column in targets) + ")")
+                    params.extend([like_pattern(term)] * len(targets))
+        return conditions, params
+
+    def match_count(self, match, cap):
+        """Number of full-text hits, counting no further than cap"""
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM (SELECT rowid FROM images_fts WHERE images_fts MATCH ? LIMIT ?)", (match, cap)
+            ).fetchone()[0]
+
+    def search(self, query, after, limit):
+        """Like page, restricted to images matching a search box query"""
+        conditions, params = self.search_conditions(query)
+        return self.select_page(conditions, params, after, limit)
+
+    def count_matching(self, query):
+        conditions, params = self.search_conditions(query, ordered=False)
+        where = f"WHERE {{' AND '.join(conditions)}}" if conditions else ""
+        with self.lock:
+            return self.conn.execute(f"SELECT COUNT(*) FROM images {{where}}", params).fetchone()[0]
+
+    def select_page(self, conditions, params, after, limit):
+        if after is not None:
+            conditions = conditions + ["(mtime, path) < (?, ?)"]
+            params = params + [after[0], after[1]]
+        where = f"WHERE {{' AND '.join(conditions)}}" if conditions else ""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM images {{where}} ORDER BY mtime DESC, path DESC LIMIT ?", (*params, limit + 1)
+            ).fetchall()
+        more = len(rows) > limit
+        rows = rows[:limit]
+        return self.entries(rows), (rows[-1]["mtime"], rows[-1]["path"]) if more else None
+
+    def changes(self, since, limit=500):
+        """Rows added or changed and paths deleted after sequence number since"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM images WHERE seq > ? ORDER BY seq LIMIT ?", (since, limit)
+            ).fetchall()
+            deleted = [row["path"] for row in self.conn.execute(
+                "SELECT path FROM deleted WHERE seq > ? ORDER BY seq", (since,))]
+            seq = self.seq
+        # A full batch means the client is too far behind to catch up cheaply
+        reset = since > seq or len(rows) >= limit
+        return self.entries(rows), deleted, seq, reset
+
+    def entries(self, rows):
+        images = []
+        for row in rows:
+            if row["indexed"]:
+                width, height = row["width"], row["height"]
+                settings = json.loads(row["settings"]) if row["settings"] else None
+            else:
+                # Requested before the background backfill reached it
+                width, height, settings = self.index_file(row["path"], row["mtime"], row["size"])
+            images.append(gallery_entry(row, width, height, settings))
+        return images
+
+def gallery_entry(row, width, height, settings):
+    try:
+        date = datetime.fromtimestamp(row["mtime"]).strftime("%m/%d %H:%M")
+    except:
+        date = "Unknown"
+    # Versioned URLs change with the file, so phones can cache them as immutable
+    version = file_version(row["size"], row["mtime"])
+    image_id = gallery_id(row["path"]) or row["name"]
+    thumb = f"/api/gallery/thumb/{{quote(image_id)}}?v={{version}}"
+    return {{
+        "id": image_id,
+        "filename": row["name"],
+        "folder": os.path.dirname(image_id),
+        "path": row["path"],
+        "thumb": f"{{thumb}}&w={{THUMB_DEFAULT_WIDTH}}",
+        "srcset": ", ".join(f"{{thumb}}&w={{width}} {{width}}w" for width in THUMB_WIDTHS),
+        "full": f"/api/gallery/full/{{quote(image_id)}}?v={{version}}",
+        "kind": "video" if is_video(row["name"]) else "image",
+        "size": f"{{row['size'] // 1024}}KB",
+        "date": date,
+        "mtime": row["mtime"],
+        "width": width,
+        "height": height,
+        "settings": settings
+    }}
+
+class GalleryWatcher:
+    """Feeds added, changed and deleted gallery files into the index as they happen.
+
+    Uses watchdog on every root recursively when it is installed, otherwise polls
+    each folder's mtime and lists again only a folder whose mtime moved.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.lock = threading.Lock()
+        self.pending = set()
+        self.wake = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self.flush_loop, daemon=True).start()
+        if Observer is not None:
+            try:
+                observer = Observer()
+                for name, root in GALLERY_ROOT_PATHS:
+                    if os.path.isdir(root):
+                        observer.schedule(self, root, recursive=True)
+                observer.daemon = True
+                observer.start()
+                print("Gallery watcher: using filesystem events")
+                return
+            except Exception as e:
+                print(f"Gallery watcher: filesystem events unavailable ({{e}})")
+        print("Gallery watcher: polling folders")
+        threading.Thread(target=self.poll_loop, daemon=True).start()
+
+    def mark(self, path):
+        if is_gallery_file(path) and gallery_id(os.path.abspath(path)):
+            with self.lock:
+                self.pending.add(path)
+            self.wake.set()
+
+    def mark_tree(self, directory):
+        """Recheck everything indexed or present below a folder that appeared, moved or vanished"""
+        directory = os.path.abspath(directory)
+        for path in self.index.paths_under(directory):
+            self.mark(path)
+        if os.path.isdir(directory):
+            for path in scan_gallery_tree(directory):
+                self.mark(path)
+
+    def dispatch(self, event):
+        """watchdog event handler entry point"""
+        if event.is_directory:
+            # A folder moved in or out arrives as one event, not one per file
+            if event.event_type != "modified":
+                self.mark_tree(os.fsdecode(event.src_path))
+                if getattr(event, "dest_path", None):
+                    self.mark_tree(os.fsdecode(event.dest_path))
+            return
+        self.mark(os.fsdecode(event.src_path))
+        if getattr(event, "dest_path", None):
+            self.mark(os.fsdecode(event.dest_path))
+
+    def flush_loop(self):
+        while True:
+            self.wake.wait()
+            # Let a burst of events for a file that is still being written settle
+            time.sleep(GALLERY_WATCH_DEBOUNCE)
+            with self.lock:
+                paths, self.pending = self.pending, set()
+                self.wake.clear()
+            for path in paths:
+                try:
+                    if self.index.update_file(path):
+                        if thumbnail_prewarmer:
+                            thumbnail_prewarmer.offer(path)
+                        if gallery_hasher:
+                            gallery_hasher.wake.set()
+                except Exception as e:
+                    print(f"Gallery watcher error for {{path}}: {{e}}")
+
+    def poll_loop(self):
+        folders = {{}}  # folder -> (mtime, relative path, {{path: (mtime, size)}})
+        settling = {{}}
+        first = True
+        while True:
+            # Files that just appeared may still be growing without touching the folder mtime
+            for path, seen in list(settling.items()):
+                try:
+                    stat = os.stat(path)
+                    current = (stat.st_mtime, stat.st_size)
+                except OSError:
+                    current = None
+                if current != seen:
+                    settling[path] = current
+                    self.mark(path)
+                else:
+                    del settling[path]
+
+            for name, root in GALLERY_ROOT_PATHS:
+                if root not in folders and os.path.isdir(root):
+                    # The reconciler indexes what is there at startup; later arrivals are news
+                    for path in scan_gallery_tree(root, folders=folders):
+                        if not first:
+                            self.mark(path)
+
+            # Only a folder whose mtime moved is listed again, nested folders are checked one by one
+            for folder, (mtime, relative, previous) in list(folders.items()):
+                try:
+                    current_mtime = os.stat(folder).st_mtime
+                except OSError:
+                    del folders[folder]
+                    for path in previous:
+                        self.mark(path)
+                    continue
+                if current_mtime == mtime:
+                    continue
+                current, subdirs = scan_gallery_dir(folder, relative)
+                folders[folder] = (current_mtime, relative, current)
+                for path, stat in current.items():
+                    if previous.get(path) != stat:
+                        settling[path] = stat
+                        self.mark(path)
+                for path in previous:
+                    if path not in current:
+                        self.mark(path)
+                for subdir, subdir_relative in subdirs:
+                    if subdir not in folders:
+                        for path in scan_gallery_tree(subdir, subdir_relative, folders):
+                            self.mark(path)
+
+            first = False
+            time.sleep(GALLERY_POLL_INTERVAL)
+
+gallery_index = None
+
+def run_gallery_reconciler():
+    while True:
+        try:
+            gallery_index.reconcile()
+            if gallery_hasher:
+                gallery_hasher.wake.set()
+        except Exception as e:
+            print(f"Gallery index error: {{e}}")
+        time.sleep(GALLERY_RECONCILE_INTERVAL)
+
+@app.on_event("startup")
+async def start_gallery_index():
+    global gallery_index, metadata_cache
+    metadata_cache = MetadataCache(METADATA_CACHE_PATH, METADATA_CACHE_MAX_ENTRIES)
+    gallery_index = GalleryIndex(GALLERY_DB_PATH)
+    threading.Thread(target=run_gallery_reconciler, daemon=True).start()
+    GalleryWatcher(gallery_index).start()
+
+class PerceptualIndex:
+    """Newest-first NumPy copy of the gallery's perceptual hashes for Hamming-distance searches.
+
+    Reloaded from the gallery index only when it changed, so a search is one XOR
+    and popcount over every hash. Duplicate groups are worked out once per reload.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.lock = threading.Lock()
+        self.version = None
+        self.groups = None
+
+    def snapshot(self):
+        """(rowids, mtimes, paths, hashes, hashed) arrays, newest first"""
+        with self.lock:
+            version = self.index.hash_version()
+            if version != self.version:
+                rowids, mtimes, paths, hashes = self.index.all_hashes()
+                self.arrays = (
+                    np.array(rowids, dtype=np.int64),
+                    np.array(mtimes, dtype=np.float64),
+                    paths,
+                    np.array([phash or 0 for phash in hashes], dtype=np.int64),
+                    np.array([phash is not None for phash in hashes], dtype=bool)
+                )
+                self.version = version
+            return self.arrays
+
+    def similar(self, phash, max_distance, limit, exclude=None):
+        """[(rowid, distance)] of the closest hashes, ties newest first"""
+        rowids, _, _, hashes, hashed = self.snapshot()
+        distances = hamming_distances(hashes, phash)
+        matches = np.flatnonzero(hashed & (distances <= max_distance) & (rowids != (exclude or 0)))
+        # A stable sort keeps equally close images in their newest-first order
+        matches = matches[np.argsort(distances[matches], kind="stable")][:limit]
+        return [(int(rowids[i]), int(distances[i])) for i in matches]
+
+    def duplicate_groups(self):
+        """(arrays, visible, counts) - the snapshot, and per row whether it leads its group and the group size.
+
+        Splits every hash into max_distance + 1 bands. Two hashes within the distance
+        must agree on at least one whole band, so only rows sharing a band value are
+        compared and the rest of the n-by-n matrix is never built.
+        """
+        arrays = self.snapshot()
+        rowids, _, _, hashes, hashed = arrays
+        with self.lock:
+            if self.groups is not None and self.groups[0] is arrays:
+                return self.groups
+
+        count = len(rowids)
+        leader = np.arange(count)
+        pairs, pending = [], 0
+        candidates = np.flatnonzero(hashed)
+        bands = DUPLICATE_MAX_DISTANCE + 1
+        bounds = [64 * band // bands for band in range(bands + 1)]
+        values = hashes.view(np.uint64)
+        for low, high in zip(bounds, bounds[1:]):
+            keys = (values[candidates] >> np.uint64(low)) & np.uint64((1 << (high - low)) - 1)
+            sort = np.argsort(keys)
+            order, keys = candidates[sort], keys[sort]
+            # Pair every row with the one offset places later in its bucket. Buckets are
+            # contiguous once sorted, so a row out of partners at one offset is done
+            active = np.arange(len(order))
+            offset = 1
+            while len(active):
+                active = active[active + offset < len(order)]
+                active = active[keys[active + offset] == keys[active]]
+                first, second = order[active], order[active + offset]
+                close = hamming_distances(hashes[first], hashes[second]) <= DUPLICATE_MAX_DISTANCE
+                # Rows already merged into one group need no pair
+                close &= leader[first] != leader[second]
+                pairs.append((first[close], second[close]))
+                pending += len(pairs[-1][0])
+                if pending > DUPLICATE_MERGE_BATCH:
+                    # Merging as we go keeps big clusters of identical images from piling up pairs
+                    leader = merge_components(leader, *map(np.concatenate, zip(*pairs)))
+                    pairs, pending = [], 0
+                offset += 1
+
+        # The newest image a chain of near-duplicates reaches leads the whole chain
+        if pairs:
+            leader = merge_components(leader, *map(np.concatenate, zip(*pairs)))
+        groups = (arrays, leader == np.arange(count), np.bincount(leader, minlength=count))
+        with self.lock:
+            self.groups = groups
+        return groups
+
+    def collapsed_page(self, after, limit):
+        """[(rowid, group size)] of group leaders after the (mtime, path) key, and the next key"""
+        (rowids, mtimes, paths, _, _), visible, counts = self.duplicate_groups()
+        start = 0
+        if after is not None:
+            start = int(np.searchsorted(-mtimes, -after[0], side="left"))
+            while start < len(rowids) and mtimes[start] == after[0] and paths[start] >= after[1]:
+                start += 1
+        leaders = np.flatnonzero(visible[start:])[:limit + 1] + start
+        more = len(leaders) > limit
+        leaders = leaders[:limit]
+        page = [(int(rowids[i]), int(counts[i])) for i in leaders]
+        last = leaders[-1] if more else None
+        return page, (float(mtimes[last]), paths[last]) if last is not None else None
+
+def merge_components(leader, first, second):
+    """Join the groups of every (first, second) row pair; each group is labelled by its lowest row.
+
+    Hooks root onto root and compresses paths until no pair spans two groups, so
+    chains of near-duplicates end up in one group however they were found.
+    """
+    while True:
+        first_roots, second_roots = leader[first], leader[second]
+        apart = first_roots != second_roots
+        if not apart.any():
+            return leader
+        first, second = first[apart], second[apart]
+        first_roots, second_roots = first_roots[apart], second_roots[apart]
+        np.minimum.at(leader, np.maximum(first_roots, second_roots), np.minimum(first_roots, second_roots))
+        while True:
+            parent = leader[leader]
+            if np.array_equal(parent, leader):
+                break
+            leader = parent
+
+def hamming_distances(hashes, other):
+    """Differing bits between int64 hashes and another hash or array of them"""
+    # Unsigned, since bitwise_count of a negative number counts the bits of its magnitude
+    difference = np.bitwise_xor(hashes, other).view(np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(difference)
+    # NumPy before 2.0 - count each byte through a lookup table
+    return POPCOUNT_TABLE[difference.view(np.uint8)].reshape(-1, 8).sum(axis=1, dtype=np.uint8)
+
+def image_dhash(source):
+    """64-bit difference hash of an image or a video's poster frame, signed so SQLite can store it.
+
+    Each bit says whether a pixel of a 9x8 grayscale shrink is brighter than its left
+    neighbour, so re-encodes, resizes and small edits flip only a few bits.
+    """
+    with open_thumbnail_source(source) as img:
+        img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+        small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return int(np.packbits(bits).view(">i8")[0])
+
+class GalleryHasher:
+    """Fills in perceptual hashes for indexed files on a low-priority process pool, newest first"""
+
+    def __init__(self, index, workers, low_priority):
+        self.index = index
+        self.workers = workers
+        self.low_priority = low_priority
+        self.wake = threading.Event()
+        self.failures = {{}}  # path -> times a worker died while it was being hashed
+        self.executor = self.new_executor()
+
+    def new_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=lower_process_priority if self.low_priority else None
+        )
+
+    def start(self):
+        threading.Thread(target=self.hash_loop, daemon=True).start()
+
+    def stop(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def hash_loop(self):
+        while True:
+            try:
+                pending = self.index.unhashed(self.workers * 8)
+            except Exception as e:
+                print(f"Gallery hasher error: {{e}}")
+                pending = []
+            if not pending:
+                self.wake.wait(GALLERY_RECONCILE_INTERVAL)
+                self.wake.clear()
+                continue
+            # Files that were in flight when a worker died are retried one at a time
+            suspects = [row for row in pending if row[0] in self.failures]
+            if suspects:
+                pending = suspects[:1]
+            try:
+                futures = [(row, self.executor.submit(image_dhash, row[0])) for row in pending]
+            except RuntimeError:
+                return  # the pool was shut down
+            broken = False
+            for (path, mtime, size), future in futures:
+                try:
+                    phash = future.result()
+                except CancelledError:
+                    # Shutting down - these files are not at fault, leave them for the next start
+                    return
+                except BrokenProcessPool:
+                    # Any file in flight may have killed the worker; one that does it alone is skipped
+                    broken = True
+                    self.failures[path] = self.failures.get(path, 0) + 1
+                    if self.failures[path] < 2:
+                        continue
+                    print(f"Could not hash {{path}}: it crashes the hashing worker")
+                    phash = None
+                except Exception as e:
+                    print(f"Could not hash {{path}}: {{e}}")
+                    phash = None
+                self.failures.pop(path, None)
+                self.index.set_hash(path, mtime, size, phash)
+            if broken:
+                print("Gallery hasher: worker pool broke, restarting it")
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = self.new_executor()
+                time.sleep(1)
+
+gallery_hasher = None
+perceptual_index = None
+
+@app.on_event("startup")
+async def start_gallery_hasher():
+    global gallery_hasher, perceptual_index
+    if np is None:
+        print("Similar images: numpy is not installed, duplicate detection is off")
+        return
+    perceptual_index = PerceptualIndex(gallery_index)
+    gallery_hasher = GalleryHasher(gallery_index, HASH_WORKERS, THUMB_PREWARM_LOW_PRIORITY)
+    gallery_hasher.start()
+
+@app.on_event("shutdown")
+async def stop_gallery_hasher():
+    if gallery_hasher:
+        gallery_hasher.stop()
+
+def extract_video_frame(source, destination):
+    """Write the first frame of a video to destination as JPEG with ffmpeg, True on success"""
+    if not FFMPEG:
+        return False
+    temp_path = f"{{destination}}.{{os.getpid()}}.{{threading.get_ident()}}.tmp.jpg"
+    try:
+        subprocess.run(
+            [FFMPEG, "-v", "error", "-y", "-i", str(source), "-frames:v", "1", "-q:v", "3", temp_path],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            timeout=VIDEO_POSTER_TIMEOUT, check=True,
+            creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0)
+        )
+        os.replace(temp_path, destination)
+        return True
+    except Exception as e:
+        print(f"Could not extract a poster frame from {{source}}: {{e}}")
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return False
+
+def placeholder_poster():
+    """Dark frame with a play symbol for videos ffmpeg could not open"""
+    from PIL import ImageDraw
+    img = Image.new("RGB", (THUMB_WIDTHS[-1], THUMB_WIDTHS[-1]), (34, 34, 34))
+    size = THUMB_WIDTHS[-1]
+    ImageDraw.Draw(img).polygon(
+        [(size * 0.38, size * 0.3), (size * 0.38, size * 0.7), (size * 0.7, size * 0.5)], fill=(200, 200, 200)
+    )
+    return img
+
+def open_thumbnail_source(source):
+    """Image to render thumbnails from - the file itself, or a video's poster frame.
+
+    Poster frames are extracted once per video version and kept in POSTER_DIR,
+    so every thumbnail width and format reuses the same frame.
+    """
+    if not is_video(source):
+        return Image.open(source)
+    stat = os.stat(source)
+    key = hashlib.sha1(f"{{os.path.abspath(source)}}|{{stat.st_size}}|{{stat.st_mtime_ns}}".encode('utf-8')).hexdigest()
+    poster = POSTER_DIR / f"{{key}}.jpg"
+    if poster.exists() or extract_video_frame(source, poster):
+        return Image.open(poster)
+    return placeholder_poster()
+
+def render_thumbnails(source, targets):
+    """Decode source once and write each (destination, width, format) target atomically.
+
+    Returns the byte size of every file written, in target order.
+    """
+    sizes = {{}}
+    with open_thumbnail_source(source) as img:
+        largest = max(width for _, width, _ in targets)
+        # Lets the JPEG decoder scale down while decoding instead of after
+        img.draft('RGB', (largest, largest))
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.mode in ("P", "LA", "PA") else "RGB")
+
+        # Shrink from largest to smallest so each step resamples the previous result
+        for destination, width, fmt in sorted(targets, key=lambda target: -target[1]):
+            img = img.copy()
+            img.thumbnail((width, width), Image.Resampling.LANCZOS)
+            frame = img.convert("RGB") if fmt == "jpeg" and img.mode != "RGB" else img
+
+            temp_path = f"{{destination}}.{{os.getpid()}}.{{threading.get_ident()}}.tmp"
+            frame.save(temp_path, **THUMB_FORMATS[fmt]["save"])
+            os.replace(temp_path, destination)
+            sizes[str(destination)] = os.path.getsize(destination)
+    return [sizes[str(destination)] for destination, _, _ in targets]
+
+def thumb_width(requested):
+    """Snap a requested width to the smallest configured width that covers it"""
+    for width in THUMB_WIDTHS:
+        if width >= requested:
+            return width
+    return THUMB_WIDTHS[-1]
+
+def thumb_format(accept):
+    """Pick the smallest thumbnail format the browser says it can display"""
+    accept = accept or ""
+    for fmt in ("avif", "webp"):
+        if fmt in THUMB_FORMATS and THUMB_FORMATS[fmt]["media_type"] in accept:
+            return fmt
+    return "jpeg"
+
+class ThumbnailCache:
+    """Content-addressed thumbnail files with a total size cap and LRU eviction.
+
+    Concurrent requests for the same thumbnail share one render.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.inflight = {{}}
+        self.background = {{}}
+
+        # Rebuild recency from file mtimes, which are bumped on every hit
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.tmp'):
+                os.remove(entry.path)
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total_bytes += size
+        self.evict()
+
+    def key(self, image_path, stat, width, fmt):
+        settings = THUMB_FORMATS[fmt]["save"]
+        source = f"{{os.path.abspath(image_path)}}|{{stat.st_size}}|{{stat.st_mtime_ns}}|{{width}}|{{sorted(settings.items())}}"
+        return hashlib.sha1(source.encode('utf-8')).hexdigest() + THUMB_FORMATS[fmt]["suffix"]
+
+    def lookup(self, name):
+        with self.lock:
+            if name not in self.entries:
+                return None
+            self.entries.move_to_end(name)
+        path = self.directory / name
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted or deleted behind our back
+            with self.lock:
+                self.total_bytes -= self.entries.pop(name, 0)
+            return None
+        return path
+
+    def add(self, name, size):
+        with self.lock:
+            self.total_bytes += size - self.entries.get(name, 0)
+            self.entries[name] = size
+            self.entries.move_to_end(name)
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            victims = []
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                name, size = self.entries.popitem(last=False)
+                self.total_bytes -= size
+                victims.append(name)
+        for name in victims:
+            try:
+                os.remove(self.directory / name)
+            except OSError:
+                pass
+
+    def render_in_background(self, image_path, executor, variants):
+        """Submit one render of all missing (width, format) variants to executor"""
+        stat = os.stat(image_path)
+        with self.lock:
+            names = []
+            for width, fmt in variants:
+                name = self.key(image_path, stat, width, fmt)
+                if name not in self.entries and name not in self.background:
+                    names.append((name, width, fmt))
+            if not names:
+                return None
+            targets = [(self.directory / name, width, fmt) for name, width, fmt in names]
+            future = executor.submit(render_thumbnails, image_path, targets)
+            for name, _, _ in names:
+                self.background[name] = future
+
+        def finished(future):
+            with self.lock:
+                for name, _, _ in names:
+                    self.background.pop(name, None)
+            try:
+                for (name, _, _), size in zip(names, future.result()):
+                    self.add(name, size)
+            except Exception as e:
+                print(f"Background thumbnail failed for {{image_path}}: {{e}}")
+
+        future.add_done_callback(finished)
+        return future
+
+    async def get(self, image_path, width, fmt):
+        """Return the path of a cached thumbnail for image_path, rendering it at most once"""
+        name = self.key(image_path, os.stat(image_path), width, fmt)
+        cached = self.lookup(name)
+        if cached:
+            return cached
+
+        future = self.inflight.get(name)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        with self.lock:
+            background = self.background.get(name)
+        if background is not None:
+            try:
+                await asyncio.wrap_future(background)
+            except Exception:
+                pass
+            cached = self.lookup(name)
+            if cached:
+                return cached
+
+        future = asyncio.get_running_loop().create_future()
+        self.inflight[name] = future
+        try:
+            destination = self.directory / name
+            sizes = await asyncio.to_thread(render_thumbnails, image_path, [(destination, width, fmt)])
+            self.add(name, sizes[0])
+            future.set_result(destination)
+            return destination
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; do not warn when there are none
+            raise
+        finally:
+            del self.inflight[name]
+
+thumbnail_cache = None
+
+@app.on_event("startup")
+async def start_thumbnail_cache():
+    global thumbnail_cache
+    thumbnail_cache = ThumbnailCache(THUMB_CACHE_DIR, THUMB_CACHE_MAX_BYTES)
+
+def lower_process_priority():
+    """Pool initializer - keeps thumbnail workers from competing with ComfyUI for the CPU"""
+    try:
+        if os.name == 'nt':
+            import ctypes
+            IDLE_PRIORITY_CLASS = 0x40
+            kernel32 = ctypes.windll.kernel32
+            kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), IDLE_PRIORITY_CLASS)
+        else:
+            os.nice(19)
+    except Exception as e:
+        print(f"Could not lower thumbnail worker priority: {{e}}")
+
+class ThumbnailPrewarmer:
+    """Renders thumbnails for newly detected outputs on a process pool before anyone asks.
+
+    The queue is bounded and overflow is dropped - those thumbnails are simply
+    rendered on request instead.
+    """
+
+    def __init__(self, cache, workers, queue_size, low_priority):
+        self.cache = cache
+        self.variants = [(width, fmt) for fmt in THUMB_PREWARM_FORMATS if fmt in THUMB_FORMATS
+                         for width in THUMB_WIDTHS]
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.slots = threading.BoundedSemaphore(workers)
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=lower_process_priority if low_priority else None
+        )
+
+    def start(self):
+        threading.Thread(target=self.dispatch_loop, daemon=True).start()
+
+    def stop(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def offer(self, image_path):
+        try:
+            self.queue.put_nowait(image_path)
+        except queue.Full:
+            pass
+
+    def dispatch_loop(self):
+        while True:
+            image_path = self.queue.get()
+            # Only keep as many renders queued in the pool as there are workers
+            self.slots.acquire()
+            try:
+                future = self.cache.render_in_background(image_path, self.executor, self.variants)
+            except Exception as e:
+                print(f"Thumbnail prewarm error for {{image_path}}: {{e}}")
+                future = None
+            if future is None:
+                self.slots.release()
+            else:
+                future.add_done_callback(lambda _: self.slots.release())
+
+thumbnail_prewarmer = None
+
+@app.on_event("startup")
+async def start_thumbnail_prewarmer():
+    global thumbnail_prewarmer
+    if THUMB_PREWARM:
+        thumbnail_prewarmer = ThumbnailPrewarmer(
+            thumbnail_cache, THUMB_PREWARM_WORKERS, THUMB_PREWARM_QUEUE, THUMB_PREWARM_LOW_PRIORITY
+        )
+        thumbnail_prewarmer.start()
+
+@app.on_event("shutdown")
+async def stop_thumbnail_prewarmer():
+    if thumbnail_prewarmer:
+        thumbnail_prewarmer.stop()
+
+# Request fields a template may bind to node inputs
+TEMPLATE_FIELDS = {{"prompt", "negative_prompt", "width", "height", "steps", "cfg_scale",
+                   "sampler", "scheduler", "model", "clip_skip", "seed", "batch_size"}}
+
+DEFAULT_TEMPLATE = "txt2img"
+
+DEFAULT_WORKFLOW = {{
+    "6": {{
+        "inputs": {{
+            "text": "",
+            "clip": ["11", 1]
         }},
-        "7": {{
-            "inputs": {{
-                "text": params.negative_prompt,
-                "clip": ["11", 1]
-            }},
-            "class_type": "CLIPTextEncode",
-            "_meta": {{"title": "CLIP Text Encode (Negative)"}}
+        "class_type": "CLIPTextEncode",
+        "_meta": {{"title": "CLIP Text Encode (Prompt)"}}
+    }},
+    "7": {{
+        "inputs": {{
+            "text": "",
+            "clip": ["11", 1]
         }},
-        "8": {{
-            "inputs": {{
-                "samples": ["13", 0],
-                "vae": ["11", 2]
-            }},
-            "class_type": "VAEDecode",
-            "_meta": {{"title": "VAE Decode"}}
+        "class_type": "CLIPTextEncode",
+        "_meta": {{"title": "CLIP Text Encode (Negative)"}}
+    }},
+    "8": {{
+        "inputs": {{
+            "samples": ["13", 0],
+            "vae": ["11", 2]
         }},
-        "9": {{
-            "inputs": {{
-                "filename_prefix": "ComfyUI",
-                "images": ["8", 0]
-            }},
-            "class_type": "SaveImage",
-            "_meta": {{"title": "Save Image"}}
+        "class_type": "VAEDecode",
+        "_meta": {{"title": "VAE Decode"}}
+    }},
+    "9": {{
+        "inputs": {{
+            "filename_prefix": "ComfyUI",
+            "images": ["8", 0]
         }},
-        "11": {{
-            "inputs": {{
-                "ckpt_name": params.model
-            }},
-            "class_type": "CheckpointLoaderSimple",
-            "_meta": {{"title": "Load Checkpoint"}}
+        "class_type": "SaveImage",
+        "_meta": {{"title": "Save Image"}}
+    }},
+    "11": {{
+        "inputs": {{
+            "ckpt_name": ""
         }},
-        "13": {{
-            "inputs": {{
-                "seed": seed,
-                "steps": params.steps,
-                "cfg": params.cfg_scale,
-                "sampler_name": params.sampler,
-                "scheduler": params.scheduler,
-                "denoise": 1,
-                "model": ["11", 0],
-                "positive": ["6", 0],
-                "negative": ["7", 0],
-                "latent_image": ["27", 0]
-            }},
-            "class_type": "KSampler",
-            "_meta": {{"title": "KSampler"}}
+        "class_type": "CheckpointLoaderSimple",
+        "_meta": {{"title": "Load Checkpoint"}}
+    }},
+    "13": {{
+        "inputs": {{
+            "seed": 0,
+            "steps": 10,
+            "cfg": 1.0,
+            "sampler_name": "lcm",
+            "scheduler": "beta",
+            "denoise": 1,
+            "model": ["11", 0],
+            "positive": ["6", 0],
+            "negative": ["7", 0],
+            "latent_image": ["27", 0]
         }},
-        "27": {{
-            "inputs": {{
-                "width": params.width,
-                "height": params.height,
-                "batch_size": 1
-            }},
-            "class_type": "EmptyLatentImage",
-            "_meta": {{"title": "Empty Latent Image"}}
-        }}
+        "class_type": "KSampler",
+        "_meta": {{"title": "KSampler"}}
+    }},
+    "27": {{
+        "inputs": {{
+            "width": 1408,
+            "height": 1408,
+            "batch_size": 1
+        }},
+        "class_type": "EmptyLatentImage",
+        "_meta": {{"title": "Empty Latent Image"}}
     }}
-    return workflow
+}}
 
-@app.get("/", response_class=HTMLResponse)
-async def get_mobile_ui():
-    html_content = \'\'\'
-<!DOCTYPE html>
+DEFAULT_BINDINGS = {{
+    "prompt": "6.text",
+    "negative_prompt": "7.text",
+    "model": "11.ckpt_name",
+    "seed": "13.seed",
+    "steps": "13.steps",
+    "cfg_scale": "13.cfg",
+    "sampler": "13.sampler_name",
+    "scheduler": "13.scheduler",
+    "width": "27.width",
+    "height": "27.height",
+    "batch_size": "27.batch_size"
+}}
+
+class WorkflowTemplate:
+    """An API-format workflow validated once and compiled into a patch plan.
+
+    Template files hold {{"workflow": <ComfyUI "Save (API Format)" export>,
+    "bindings": {{"<request field>": "<node id>.<input>" or a list of them}},
+    "description": "..."}}. Applying a request copies only the patched nodes,
+    every other node is shared with the compiled original.
+    """
+
+    def __init__(self, name, workflow, bindings, description=""):
+        self.name = name
+        self.description = description
+        self.workflow = workflow
+        self.plan = self.compile(workflow, bindings)
+        self.fields = sorted({{field for patches in self.plan.values() for _, field in patches}})
+
+    @staticmethod
+    def compile(workflow, bindings):
+        """Check every binding against the graph and group them by node"""
+        if not isinstance(workflow, dict) or not workflow:
+            raise ValueError("workflow must be a non-empty API-format node mapping")
+        for node_id, node in workflow.items():
+            if not isinstance(node, dict) or "class_type" not in node or not isinstance(node.get("inputs"), dict):
+                raise ValueError(f"node {{node_id}} is not an API-format node (missing class_type or inputs)")
+
+        plan = {{}}
+        for field, targets in bindings.items():
+            if field not in TEMPLATE_FIELDS:
+                raise ValueError(f"unknown request field '{{field}}'")
+            for target in [targets] if isinstance(targets, str) else targets:
+                node_id, _, input_name = str(target).partition(".")
+                node = workflow.get(node_id)
+                if node is None:
+                    raise ValueError(f"binding {{field}} -> {{target}}: no node {{node_id}}")
+                if input_name not in node["inputs"]:
+                    raise ValueError(f"binding {{field}} -> {{target}}: node {{node_id}} has no input '{{input_name}}'")
+                if isinstance(node["inputs"][input_name], list):
+                    raise ValueError(f"binding {{field}} -> {{target}}: input is linked to another node")
+                plan.setdefault(node_id, []).append((input_name, field))
+        return plan
+
+    def binds(self, field):
+        return field in self.fields
+
+    def apply(self, params, batch_size=1):
+        """Build the workflow for one request, copying only the nodes it changes"""
+        seed = params.seed if params.seed != -1 else random_seed()
+        workflow = dict(self.workflow)
+        for node_id, patches in self.plan.items():
+            node = dict(workflow[node_id])
+            inputs = node["inputs"] = dict(node["inputs"])
+            for input_name, field in patches:
+                if field == "seed":
+                    inputs[input_name] = seed
+                elif field == "batch_size":
+                    inputs[input_name] = batch_size
+                else:
+                    inputs[input_name] = getattr(params, field)
+            workflow[node_id] = node
+        return workflow
+
+    def describe(self):
+        return {{"name": self.name, "description": self.description, "fields": self.fields}}
+
+class TemplateLibrary:
+    """The built-in txt2img graph plus every template file in TEMPLATES_DIR.
+
+    Files are parsed and compiled when they first appear or change on disk,
+    never per request. Broken files are reported and skipped.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.templates = {{DEFAULT_TEMPLATE: WorkflowTemplate(
+            DEFAULT_TEMPLATE, DEFAULT_WORKFLOW, DEFAULT_BINDINGS, "Built-in text to image")}}
+        self.files = {{}}  # path -> (mtime_ns, size, template name or None if it failed)
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Compile new or changed template files and drop deleted ones"""
+        with self.lock:
+            seen = set()
+            try:
+                entries = [entry for entry in os.scandir(self.directory)
+                           if entry.is_file() and entry.name.lower().endswith(".json")]
+            except OSError:
+                entries = []
+            for entry in entries:
+                seen.add(entry.path)
+                stat = entry.stat()
+                known = self.files.get(entry.path)
+                if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+                    continue
+                if known and known[2]:
+                    self.templates.pop(known[2], None)
+                self.files[entry.path] = (stat.st_mtime_ns, stat.st_size, self.load(entry.path))
+            for path in set(self.files) - seen:
+                name = self.files.pop(path)[2]
+                if name:
+                    self.templates.pop(name, None)
+
+    def load(self, path):
+        name = Path(path).stem
+        if name == DEFAULT_TEMPLATE:
+            print(f"Skipping workflow template {{path}}: '{{DEFAULT_TEMPLATE}}' is the built-in name")
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.templates[name] = WorkflowTemplate(
+                name, data["workflow"], data.get("bindings", {{}}), data.get("description", ""))
+            return name
+        except Exception as e:
+            print(f"Skipping workflow template {{path}}: {{e}}")
+            return None
+
+    def get(self, name):
+        name = name or DEFAULT_TEMPLATE
+        template = self.templates.get(name)
+        if template is None:
+            # It may have been dropped into the folder since the last refresh
+            self.refresh()
+            template = self.templates.get(name)
+        if template is None:
+            raise HTTPException(status_code=400, detail=f"Unknown workflow template: {{name}}")
+        return template
+
+    def list(self):
+        self.refresh()
+        return [template.describe() for template in self.templates.values()]
+
+workflow_templates = TemplateLibrary(TEMPLATES_DIR)
+
+@app.on_event("startup")
+async def load_workflow_templates():
+    await asyncio.to_thread(workflow_templates.refresh)
+    print(f"Workflow templates: {{', '.join(workflow_templates.templates)}}")
+
+def create_workflow(params: GenerateRequest, batch_size=1):
+    return workflow_templates.get(params.template).apply(params, batch_size)
+
+def random_seed():
+    return int.from_bytes(os.urandom(4), 'big')
+
+def batch_prompts(request: BatchRequest):
+    return [text for text in request.prompts if text.strip()] or [request.prompt]
+
+def batch_image_count(request: BatchRequest):
+    """Images a batch request asks for, worked out without expanding it"""
+    return len(batch_prompts(request)) * max(1, request.seed_count) * max(1, request.batch_size)
+
+def plan_batch(request: BatchRequest):
+    """Split a batch request into ComfyUI prompts as [(params, batch_size), ...].
+
+    Variations of one prompt and seed share a latent batch; every prompt text and
+    explicit seed needs its own queue entry since they live in the graph itself.
+    """
+    texts = batch_prompts(request)
+    batch_size = max(1, request.batch_size)
+    # Templates without a bound latent batch size get one queue entry per image
+    latent_limit = BATCH_MAX_LATENT if workflow_templates.get(request.template).binds("batch_size") else 1
+    if request.seed_count > 1:
+        start = request.seed if request.seed != -1 else random_seed()
+        seeds = [(start + i) % 2 ** 32 for i in range(request.seed_count)]
+    else:
+        seeds = [request.seed]
+
+    plan = []
+    for text in texts:
+        for seed in seeds:
+            remaining = batch_size
+            chunk_seed = seed
+            while remaining > 0:
+                size = min(remaining, latent_limit)
+                params = request.model_copy(update={{"prompt": text, "seed": chunk_seed}})
+                plan.append((params, size))
+                remaining -= size
+                # Later chunks need fresh noise or they would repeat the first one
+                chunk_seed = random_seed() if seed == -1 else (chunk_seed + size) % 2 ** 32
+    return plan
+
+async def submit_workflow(backend, workflow):
+    """Queue one workflow on a backend and return its prompt id"""
+    response = await backend.client.post(
+        "/prompt",
+        json={{"prompt": workflow, "client_id": backend.events.client_id}},
+        timeout=30
+    )
+    if response.status_code != 200:
+        raise HTTPException(status_code=500, detail=f"ComfyUI error: {{response.text}}")
+    return response.json()["prompt_id"]
+
+def required_checkpoint(params: GenerateRequest):
+    """The checkpoint a request needs, or None if its template doesn't take the model field"""
+    return params.model if workflow_templates.get(params.template).binds("model") else None
+
+async def dispatch_workflows(checkpoint, workflows):
+    """Queue a job's workflows, in order, on one backend and return (backend, prompt ids).
+
+    A backend that refuses the connection is marked down and the next best one tried.
+    """
+    while True:
+        backend = await comfy_backends.pick(checkpoint)
+        prompt_ids = []
+        try:
+            for workflow in workflows:
+                prompt_ids.append(await submit_workflow(backend, workflow))
+        except httpx.ConnectError as e:
+            if prompt_ids:
+                # Part of a batch is already queued there, so it stays on that backend
+                raise
+            backend.snapshot.error = str(e)
+            backend.snapshot.poke()
+            continue
+        backend.dispatched.append((time.time(), len(prompt_ids)))
+        backend.snapshot.poke()
+        return backend, prompt_ids
+
+MOBILE_UI_HTML = \'\'\'
+<!DOCTYPE html>
 <html lang="en">
 <head>
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <meta name="theme-color" content="#1a1a1a">
+    <meta name="apple-mobile-web-app-capable" content="yes">
     <title>ComfyUI Mobile</title>
+    <link rel="manifest" href="/manifest.webmanifest">
     <style>
         * {{ margin: 0; padding: 0; box-sizing: border-box; }}
         body {{ 
@@ -417,6 +2342,8 @@ async def get_mobile_ui():
         }}
         .btn:hover {{ background: #005ecb; }}
         .btn:disabled {{ background: #555; cursor: not-allowed; }}
+        .btn.cancel {{ background: #c0392b; width: 100%; }}
+        .btn.cancel:hover {{ background: #a93226; }}
         .progress {{ 
             width: 100%; height: 6px; background: #333;
             border-radius: 3px; margin: 10px 0; overflow: hidden;
@@ -434,6 +2361,7 @@ async def get_mobile_ui():
             max-width: 100%; height: auto; border-radius: 12px;
             box-shadow: 0 8px 32px rgba(0,0,0,0.6);
         }}
+        .result-grid {{ display: grid; grid-template-columns: repeat(2, 1fr); gap: 10px; }}
         .status {{ 
             padding: 12px; background: #2a2a2a; border-radius: 8px;
             margin: 10px 0; text-align: center; font-size: 14px;
@@ -473,6 +2401,10 @@ async def get_mobile_ui():
             width: 100%; height: 150px; object-fit: cover;
             display: block;
         }}
+        .gallery-item .badge {{ 
+            position: absolute; top: 6px; right: 6px; background: rgba(0,0,0,0.7);
+            border-radius: 4px; padding: 2px 6px; font-size: 10px; color: #fff;
+        }}
         .gallery-item .info {{ 
             position: absolute; bottom: 0; left: 0; right: 0;
             background: linear-gradient(transparent, rgba(0,0,0,0.8));
@@ -488,6 +2420,11 @@ async def get_mobile_ui():
             background: #333; border: 1px solid #555; color: #fff;
             padding: 10px 20px; border-radius: 6px; cursor: pointer;
         }}
+        .gallery-search {{ width: 100%; margin-top: 5px; }}
+        .gallery-item .badge.group {{ right: auto; left: 6px; }}
+        .load-more-btn.active {{ background: #007AFF; border-color: #007AFF; }}
+        .gallery-mode {{ text-align: center; font-size: 12px; color: #ccc; margin-top: 8px; }}
+        .gallery-mode a {{ color: #007AFF; }}
         
         .modal {{ 
             display: none; position: fixed; top: 0; left: 0; width: 100%; height: 100%;
@@ -502,7 +2439,7 @@ async def get_mobile_ui():
             position: absolute; top: 10px; right: 15px; 
             background: none; border: none; color: #fff; font-size: 24px; cursor: pointer;
         }}
-        .modal img {{ 
+        .modal img, .modal video {{ 
             max-width: 100%; height: auto; border-radius: 8px; margin-bottom: 15px;
         }}
         .modal-actions {{ 
@@ -538,8 +2475,16 @@ async def get_mobile_ui():
             <div class="status" id="status" style="display: none;"></div>
             
             <button type="submit" class="btn" id="generateBtn" onclick="generateImage()">Generate Image</button>
+            <button type="button" class="btn cancel" id="cancelBtn" onclick="cancelGeneration()" style="display: none;">Cancel</button>
             
             <form id="generateForm">
+                <div class="form-group" id="templateGroup" style="display: none;">
+                    <label>Workflow</label>
+                    <select id="template">
+                        <option value="txt2img">txt2img</option>
+                    </select>
+                </div>
+                
                 <div class="form-group">
                     <label>Model</label>
                     <select id="model">
@@ -583,6 +2528,14 @@ async def get_mobile_ui():
                     </div>
                 </div>
                 
+                <div class="form-group">
+                    <label>Images</label>
+                    <div class="range-container">
+                        <input type="range" id="batchSize" min="1" max="8" value="1">
+                        <div class="range-value" id="batchSizeDisplay">1</div>
+                    </div>
+                </div>
+                
                 <div class="form-group">
                     <label>CFG Scale: <span id="cfgValue">1.0</span></label>
                     <div class="range-container">
@@ -626,7 +2579,11 @@ async def get_mobile_ui():
         <div id="gallery-tab" class="tab-content">
             <div class="gallery-controls">
                 <button class="load-more-btn" onclick="loadImages()">Refresh Gallery</button>
+                <button class="load-more-btn" id="collapseBtn" onclick="toggleCollapse()">Collapse Duplicates</button>
             </div>
+            <input type="search" id="gallerySearch" class="gallery-search" oninput="searchGallery()"
+                   placeholder="Search prompts, e.g. castle model:sdxl steps:20-30">
+            <div id="galleryMode" class="gallery-mode" style="display: none;"></div>
             <div id="galleryGrid" class="gallery-grid">
                 <div class="gallery-loading">Loading images...</div>
             </div>
@@ -640,8 +2597,10 @@ async def get_mobile_ui():
         <div class="modal-content">
             <button class="modal-close" onclick="closeModal()">&times;</button>
             <img id="modalImage" src="" alt="Selected image">
+            <video id="modalVideo" controls playsinline loop preload="metadata" style="display: none;"></video>
             <div class="modal-actions">
                 <button class="modal-btn" onclick="useImageSettings()">Use Settings</button>
+                <button class="modal-btn secondary" onclick="findSimilar()">Find Similar</button>
                 <button class="modal-btn secondary" onclick="closeModal()">Cancel</button>
             </div>
             <div id="modalInfo" style="margin-top: 15px; font-size: 12px; color: #ccc;"></div>
@@ -651,7 +2610,13 @@ async def get_mobile_ui():
     <script>
         let currentTab = 'generate';
         let galleryImages = [];
-        let galleryOffset = 0;
+        let galleryCursor = null;
+        let gallerySearch = '';
+        let gallerySearchTimer = null;
+        let galleryRequest = 0;
+        let galleryCollapse = false;
+        let gallerySimilar = null;
+        let gallerySeq = 0;
         let selectedImageData = null;
         
         function showTab(tab) {{
@@ -669,6 +2634,8 @@ async def get_mobile_ui():
         
         const form = document.getElementById('generateForm');
         const btn = document.getElementById('generateBtn');
+        const cancelBtn = document.getElementById('cancelBtn');
+        let currentJob = null;
         const progress = document.getElementById('progress');
         const progressBar = document.getElementById('progressBar');
         const status = document.getElementById('status');
@@ -681,10 +2648,13 @@ async def get_mobile_ui():
         const cfgDisplay = document.getElementById('cfgDisplay');
         const clipSkip = document.getElementById('clipSkip');
         const clipSkipDisplay = document.getElementById('clipSkipDisplay');
+        const batchSize = document.getElementById('batchSize');
+        const batchSizeDisplay = document.getElementById('batchSizeDisplay');
         
         steps.oninput = () => stepsDisplay.textContent = steps.value;
         cfgScale.oninput = () => cfgDisplay.textContent = cfgScale.value;
         clipSkip.oninput = () => clipSkipDisplay.textContent = clipSkip.value;
+        batchSize.oninput = () => batchSizeDisplay.textContent = batchSize.value;
         
         document.querySelectorAll('.preset-btn').forEach(btn => {{
             btn.addEventListener('click', () => {{
@@ -696,29 +2666,43 @@ async def get_mobile_ui():
             }});
         }});
         
+        function fillSelect(select, values) {{
+            const currentSelection = select.value;
+            const labels = {{}};
+            select.querySelectorAll('option').forEach(o => labels[o.value] = o.textContent);
+            
+            select.innerHTML = '';
+            values.forEach(value => {{
+                const option = document.createElement('option');
+                option.value = value;
+                option.textContent = labels[value] || value;
+                select.appendChild(option);
+            }});
+            
+            if (currentSelection && values.includes(currentSelection)) {{
+                select.value = currentSelection;
+                return true;
+            }}
+            return false;
+        }}
+        
         async function loadModels() {{
             try {{
-                const response = await fetch('/api/models');
-                const models = await response.json();
+                // The catalog carries an ETag, so unchanged catalogs come back as a 304
+                const response = await fetch('/api/catalog');
+                const catalog = await response.json();
                 const modelSelect = document.getElementById('model');
+                const models = catalog.checkpoints;
                 
-                const currentSelection = modelSelect.value;
-                
-                modelSelect.innerHTML = '';
-                models.forEach(model => {{
-                    const option = document.createElement('option');
-                    option.value = model;
-                    option.textContent = model;
-                    modelSelect.appendChild(option);
-                }});
-                
-                if (currentSelection && models.includes(currentSelection)) {{
-                    modelSelect.value = currentSelection;
-                }} else {{
+                if (!fillSelect(modelSelect, models)) {{
                     const defaultModel = models.find(m => m.includes('mopMixtureOfPerverts'));
                     if (defaultModel) modelSelect.value = defaultModel;
                 }}
+                if (catalog.samplers.length) fillSelect(document.getElementById('sampler'), catalog.samplers);
+                if (catalog.schedulers.length) fillSelect(document.getElementById('scheduler'), catalog.schedulers);
                 
+                // The service worker answers with the last catalog while the PC is away
+                if (!catalog.connected || response.headers.has('X-Offline-Copy')) throw new Error('ComfyUI unreachable');
                 connectionStatus.textContent = 'Connected to ComfyUI';
                 connectionStatus.style.background = '#1a4d1a';
             }} catch (error) {{
@@ -738,10 +2722,19 @@ async def get_mobile_ui():
                 sampler: document.getElementById('sampler').value,
                 scheduler: document.getElementById('scheduler').value,
                 model: document.getElementById('model').value,
+                template: document.getElementById('template').value,
                 clip_skip: parseInt(document.getElementById('clipSkip').value),
                 seed: -1
             }};
             
+            // Variations go out as one batch job with a single status stream
+            const count = parseInt(batchSize.value);
+            let endpoint = '/api/generate';
+            if (count > 1) {{
+                data.batch_size = count;
+                endpoint = '/api/generate/batch';
+            }}
+            
             btn.disabled = true;
             btn.textContent = 'Generating...';
             form.classList.add('loading');
@@ -750,7 +2743,7 @@ async def get_mobile_ui():
             status.textContent = 'Starting generation...';
             
             try {{
-                const response = await fetch('/api/generate', {{
+                const response = await fetch(endpoint, {{
                     method: 'POST',
                     headers: {{'Content-Type': 'application/json'}},
                     body: JSON.stringify(data)
@@ -759,7 +2752,10 @@ async def get_mobile_ui():
                 const jobData = await response.json();
                 
                 if (response.ok) {{
-                    pollProgress(jobData.job_id);
+                    currentJob = jobData.job_id;
+                    cancelBtn.disabled = false;
+                    cancelBtn.style.display = 'block';
+                    watchProgress(jobData.job_id);
                 }} else {{
                     throw new Error(jobData.detail || 'Generation failed');
                 }}
@@ -769,6 +2765,99 @@ async def get_mobile_ui():
             }}
         }}
         
+        function showResult(jobId, count = 1) {{
+            progressBar.style.width = '100%';
+            status.textContent = 'Generation complete!';
+            if (count > 1) {{
+                let images = '';
+                for (let i = 0; i < count; i++) {{
+                    images += `<img src="/api/image/${{jobId}}?index=${{i}}" alt="Generated image ${{i + 1}}" onclick="window.open(this.src)">`;
+                }}
+                result.innerHTML = `<div class="result-grid">${{images}}</div>`;
+            }} else {{
+                result.innerHTML = `<img src="/api/image/${{jobId}}" alt="Generated image" onclick="window.open(this.src)">`;
+            }}
+            resetForm();
+            if (galleryImages.length > 0) {{
+                setTimeout(() => syncGallery(), 1000);
+            }}
+        }}
+        
+        async function cancelGeneration() {{
+            if (!currentJob) return;
+            cancelBtn.disabled = true;
+            status.textContent = 'Cancelling...';
+            try {{
+                const response = await fetch(`/api/cancel/${{currentJob}}`, {{ method: 'POST' }});
+                if (!response.ok) {{
+                    const data = await response.json();
+                    throw new Error(data.detail || 'Cancel failed');
+                }}
+            }} catch (error) {{
+                status.textContent = 'Error: ' + error.message;
+                cancelBtn.disabled = false;
+            }}
+        }}
+        
+        function watchProgress(jobId) {{
+            if (!window.EventSource) {{
+                return pollProgress(jobId);
+            }}
+            
+            const source = new EventSource(`/api/events/${{jobId}}`);
+            let finished = false;
+            
+            source.onmessage = (event) => {{
+                const data = JSON.parse(event.data);
+                
+                if (data.status === 'completed') {{
+                    finished = true;
+                    source.close();
+                    showResult(jobId, data.images);
+                }} else if (data.status === 'failed') {{
+                    finished = true;
+                    source.close();
+                    status.textContent = data.cancelled ? 'Cancelled' : 'Error: ' + (data.error || 'Generation failed');
+                    resetForm();
+                }} else if (data.status === 'processing') {{
+                    const percent = data.progress || 0;
+                    progressBar.style.width = Math.max(5, percent) + '%';
+                    if (data.total_prompts) {{
+                        status.textContent = `Batch ${{data.completed_prompts}}/${{data.total_prompts}} ${{percent}}%`;
+                    }} else {{
+                        status.textContent = data.steps
+                            ? `Step ${{data.step}}/${{data.steps}} ${{percent}}%`
+                            : `Processing ${{percent}}%`;
+                    }}
+                }} else if (data.status === 'queued') {{
+                    progressBar.style.width = '5%';
+                    status.textContent = data.queue_position
+                        ? `Waiting in queue (Position: ${{data.queue_position}})`
+                        : 'Waiting in queue';
+                }}
+            }};
+            
+            // Latent previews arrive as their own event, throttled by the server
+            source.addEventListener('preview', (event) => {{
+                const data = JSON.parse(event.data);
+                let preview = document.getElementById('livePreview');
+                if (!preview) {{
+                    result.innerHTML = '<img id="livePreview" alt="Preview">';
+                    preview = document.getElementById('livePreview');
+                }}
+                preview.src = data.image;
+            }});
+            
+            source.onerror = () => {{
+                // Fall back to polling if the stream cannot be kept open
+                if (!finished) {{
+                    finished = true;
+                    source.close();
+                    pollProgress(jobId);
+                }}
+            }};
+        }}
+        
         async function pollProgress(jobId) {{
             const maxAttempts = 300;
             let attempts = 0;
@@ -780,13 +2869,7 @@ async def get_mobile_ui():
                     const data = await response.json();
                     
                     if (data.status === 'completed') {{
-                        progressBar.style.width = '100%';
-                        status.textContent = 'Generation complete!';
-                        result.innerHTML = `<img src="/api/image/${{jobId}}" alt="Generated image" onclick="window.open(this.src)">`;
-                        resetForm();
-                        if (currentTab === 'gallery') {{
-                            setTimeout(() => loadImages(), 1000);
-                        }}
+                        showResult(jobId, data.images);
                     }} else if (data.status === 'failed') {{
                         throw new Error(data.error || 'Generation failed');
                     }} else if (data.status === 'processing') {{
@@ -848,6 +2931,8 @@ async def get_mobile_ui():
         }}
         
         function resetForm() {{
+            currentJob = null;
+            cancelBtn.style.display = 'none';
             btn.disabled = false;
             btn.textContent = 'Generate Image';
             form.classList.remove('loading');
@@ -859,16 +2944,30 @@ async def get_mobile_ui():
         
         async function loadImages(reset = true) {{
             if (reset) {{
-                galleryOffset = 0;
+                galleryCursor = null;
                 galleryImages = [];
             }}
             
+            const request = ++galleryRequest;
             try {{
-                const response = await fetch(`/api/gallery?offset=${{galleryOffset}}&limit=20`);
+                // Cursors pin the position, so new outputs never duplicate or skip items
+                const cursor = galleryCursor ? `&cursor=${{encodeURIComponent(galleryCursor)}}` : '';
+                const collapse = galleryCollapse ? '&collapse=true' : '';
+                const url = gallerySimilar
+                    ? `/api/gallery/similar/${{gallerySimilar.id.split('/').map(encodeURIComponent).join('/')}}?limit=60`
+                    : gallerySearch
+                    ? `/api/gallery/search?q=${{encodeURIComponent(gallerySearch)}}&limit=20${{cursor}}`
+                    : `/api/gallery?limit=20${{cursor}}${{collapse}}`;
+                const response = await fetch(url);
                 const data = await response.json();
+                // A newer search was typed while this one was on its way
+                if (request !== galleryRequest) return;
+                if (!response.ok) throw new Error(data.detail || 'Gallery request failed');
                 
                 if (reset) {{
                     galleryImages = data.images;
+                    gallerySeq = data.seq;
+                    showGalleryMode(data);
                 }} else {{
                     galleryImages = [...galleryImages, ...data.images];
                 }}
@@ -877,7 +2976,8 @@ async def get_mobile_ui():
                 
                 document.getElementById('loadMoreBtn').style.display = 
                     data.has_more ? 'block' : 'none';
-                galleryOffset += data.images.length;
+                galleryCursor = data.next_cursor;
+                saveGalleryCache();
                 
             }} catch (error) {{
                 document.getElementById('galleryGrid').innerHTML = 
@@ -889,6 +2989,124 @@ async def get_mobile_ui():
             loadImages(false);
         }}
         
+        function searchGallery() {{
+            clearTimeout(gallerySearchTimer);
+            gallerySearchTimer = setTimeout(() => {{
+                gallerySearch = document.getElementById('gallerySearch').value.trim();
+                gallerySimilar = null;
+                loadImages();
+            }}, 300);
+        }}
+        
+        function toggleCollapse() {{
+            galleryCollapse = !galleryCollapse;
+            gallerySimilar = null;
+            document.getElementById('collapseBtn').classList.toggle('active', galleryCollapse);
+            loadImages();
+        }}
+        
+        function findSimilar() {{
+            if (!selectedImageData || !selectedImageData.id) return;
+            gallerySimilar = selectedImageData;
+            closeModal();
+            loadImages();
+        }}
+        
+        function showAllImages() {{
+            gallerySimilar = null;
+            loadImages();
+        }}
+        
+        function showGalleryMode(data) {{
+            const mode = document.getElementById('galleryMode');
+            if (gallerySimilar) {{
+                mode.innerHTML = `${{data.images.length}} similar to ${{gallerySimilar.filename}} &middot; ` +
+                    '<a href="#" onclick="showAllImages(); return false;">Show all</a>';
+            }} else if (galleryCollapse && !gallerySearch && data.groups !== undefined) {{
+                mode.textContent = `${{data.total}} images in ${{data.groups}} groups`;
+            }} else {{
+                mode.style.display = 'none';
+                return;
+            }}
+            mode.style.display = 'block';
+        }}
+        
+        async function syncGallery() {{
+            if (gallerySearch || gallerySimilar || galleryCollapse) {{
+                // New outputs may or may not match or join a group, so ask again
+                return loadImages();
+            }}
+            try {{
+                const response = await fetch(`/api/gallery/changes?since=${{gallerySeq}}`);
+                const data = await response.json();
+                
+                if (data.reset) {{
+                    return loadImages();
+                }}
+                
+                const changed = new Set(data.images.map(img => img.path));
+                const deleted = new Set(data.deleted);
+                const before = galleryImages.length;
+                // Changes below the loaded window arrive with a later page instead
+                const last = galleryImages[before - 1];
+                const loaded = img => !galleryCursor || !last || img.mtime > last.mtime ||
+                    (img.mtime === last.mtime && img.path > last.path);
+                galleryImages = galleryImages.filter(img => !changed.has(img.path) && !deleted.has(img.path));
+                const removed = before - galleryImages.length;
+                
+                galleryImages = [...data.images.filter(loaded), ...galleryImages].sort(
+                    (a, b) => b.mtime - a.mtime || (a.path < b.path ? 1 : a.path > b.path ? -1 : 0));
+                gallerySeq = data.seq;
+                
+                if (data.images.length > 0 || removed > 0) {{
+                    renderGallery();
+                }}
+                saveGalleryCache();
+            }} catch (error) {{
+                // Unreachable PC - keep showing the cached gallery rather than an error
+                if (galleryImages.length === 0) loadImages();
+            }}
+        }}
+        
+        // The plain newest-first gallery is kept in IndexedDB, so it shows before the PC answers
+        // and only the changes since then are fetched
+        const galleryCache = new Promise(resolve => {{
+            if (!window.indexedDB) return resolve(null);
+            const request = indexedDB.open('comfyui-mobile', 1);
+            request.onupgradeneeded = () => request.result.createObjectStore('gallery');
+            request.onsuccess = () => resolve(request.result);
+            request.onerror = () => resolve(null);
+        }});
+        
+        async function saveGalleryCache() {{
+            if (gallerySearch || gallerySimilar || galleryCollapse) return;
+            const db = await galleryCache;
+            if (!db) return;
+            db.transaction('gallery', 'readwrite').objectStore('gallery').put({{
+                images: galleryImages,
+                cursor: galleryCursor,
+                seq: gallerySeq
+            }}, 'state');
+        }}
+        
+        async function restoreGallery() {{
+            const db = await galleryCache;
+            if (!db) return;
+            const state = await new Promise(resolve => {{
+                const request = db.transaction('gallery').objectStore('gallery').get('state');
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => resolve(null);
+            }});
+            // Something newer was loaded from the PC in the meantime
+            if (!state || galleryImages.length > 0 || galleryRequest > 0) return;
+            galleryImages = state.images;
+            galleryCursor = state.cursor;
+            gallerySeq = state.seq;
+            document.getElementById('loadMoreBtn').style.display = galleryCursor ? 'block' : 'none';
+            renderGallery();
+            syncGallery();
+        }}
+        
         function renderGallery() {{
             const grid = document.getElementById('galleryGrid');
             
@@ -899,7 +3117,10 @@ async def get_mobile_ui():
             
             grid.innerHTML = galleryImages.map((img, index) => `
                 <div class="gallery-item" onclick="selectImage(${{index}})">
-                    <img src="/api/gallery/thumb/${{img.filename}}" alt="Generated image" loading="lazy">
+                    <img src="${{img.thumb}}" srcset="${{img.srcset}}"
+                         sizes="(max-width: 520px) 50vw, 245px" alt="Generated image" loading="lazy">
+                    ${{img.kind === 'video' ? '<div class="badge">&#9654; video</div>' : ''}}
+                    ${{img.duplicates ? `<div class="badge group">+${{img.duplicates}} similar</div>` : ''}}
                     <div class="info">
                         ${{img.date}} ${{img.size}}
                     </div>
@@ -913,9 +3134,24 @@ async def get_mobile_ui():
             const modalImage = document.getElementById('modalImage');
             const modalInfo = document.getElementById('modalInfo');
             
-            modalImage.src = `/api/gallery/full/${{selectedImageData.filename}}`;
+            const modalVideo = document.getElementById('modalVideo');
+            const fullUrl = selectedImageData.full || `/api/gallery/full/${{encodeURIComponent(selectedImageData.filename)}}`;
+            
+            // Videos stream through Range requests, so only the part being watched is fetched
+            if (selectedImageData.kind === 'video') {{
+                modalImage.style.display = 'none';
+                modalImage.removeAttribute('src');
+                modalVideo.style.display = 'block';
+                modalVideo.poster = selectedImageData.thumb;
+                modalVideo.src = fullUrl;
+            }} else {{
+                modalVideo.style.display = 'none';
+                modalImage.style.display = 'block';
+                modalImage.src = fullUrl;
+            }}
             
             let infoHtml = `<strong>File:</strong> ${{selectedImageData.filename}}<br>`;
+            if (selectedImageData.folder) infoHtml += `<strong>Folder:</strong> ${{selectedImageData.folder}}<br>`;
             infoHtml += `<strong>Size:</strong> ${{selectedImageData.size}}<br>`;
             infoHtml += `<strong>Date:</strong> ${{selectedImageData.date}}<br>`;
             
@@ -937,6 +3173,10 @@ async def get_mobile_ui():
         
         function closeModal() {{
             document.getElementById('imageModal').classList.remove('active');
+            const modalVideo = document.getElementById('modalVideo');
+            modalVideo.pause();
+            modalVideo.removeAttribute('src');
+            modalVideo.load();
         }}
         
         function useImageSettings() {{
@@ -982,137 +3222,1138 @@ async def get_mobile_ui():
             window.scrollTo(0, 0);
         }}
         
+        async function loadTemplates() {{
+            try {{
+                const response = await fetch('/api/templates');
+                const data = await response.json();
+                const select = document.getElementById('template');
+                fillSelect(select, data.templates.map(t => t.name));
+                // Only worth a control once someone added their own workflows
+                document.getElementById('templateGroup').style.display = data.templates.length > 1 ? 'block' : 'none';
+            }} catch (error) {{
+                console.error('Error loading templates:', error);
+            }}
+        }}
+        
         loadModels();
+        loadTemplates();
+        restoreGallery();
         setInterval(loadModels, 30000);
         
+        // Only secure pages get a service worker - over plain http the IndexedDB cache still works
+        if ('serviceWorker' in navigator) {{
+            navigator.serviceWorker.register('/sw.js').catch(error => console.error('Service worker:', error));
+        }}
+        
         document.addEventListener('keydown', (e) => {{
             if (e.key === 'Escape') closeModal();
         }});
     </script>
 </body>
 </html>
-    \'\'\'
-    return HTMLResponse(content=html_content)
+\'\'\'
 
-jobs = {{}}
+# Service worker for the installed app. Build tokens are filled in by build_service_worker
+SERVICE_WORKER_JS = """
+const VERSION = '__VERSION__';
+const SHELL_CACHE = 'shell-' + VERSION;
+const THUMB_CACHE = 'thumbs';
+const DATA_CACHE = 'data';
+const PRECACHE = __PRECACHE__;
+const THUMB_MAX_BYTES = __THUMB_MAX_BYTES__;
+const NETWORK_TIMEOUT = 4000;
+let trimming = null;
 
-@app.get("/api/models")
-async def get_models():
+self.addEventListener('install', event => {{
+    event.waitUntil(caches.open(SHELL_CACHE).then(cache => cache.addAll(PRECACHE)).then(() => self.skipWaiting()));
+}});
+
+self.addEventListener('activate', event => {{
+    event.waitUntil(caches.keys().then(names => Promise.all(
+        names.filter(name => name.startsWith('shell-') && name !== SHELL_CACHE).map(name => caches.delete(name))
+    )).then(() => self.clients.claim()));
+}});
+
+self.addEventListener('fetch', event => {{
+    const request = event.request;
+    const url = new URL(request.url);
+    if (request.method !== 'GET' || url.origin !== location.origin) return;
+
+    if (request.mode === 'navigate' || url.pathname === '/') {{
+        event.respondWith(cachedShell(event));
+    }} else if (url.pathname.startsWith('/ui/')) {{
+        event.respondWith(caches.match(request).then(cached => cached || fetch(request)));
+    }} else if (url.pathname.startsWith('/api/gallery/thumb/')) {{
+        event.respondWith(cachedThumbnail(event));
+    }} else if (url.pathname === '/api/catalog' || url.pathname === '/api/templates') {{
+        event.respondWith(networkFirst(request));
+    }}
+}});
+
+// The page opens from the cache at once and the next open gets whatever the PC has now
+async function cachedShell(event) {{
+    const cache = await caches.open(SHELL_CACHE);
+    const cached = await cache.match('/');
+    const refresh = fetch('/').then(response => {{
+        if (response.ok) return cache.put('/', response.clone()).then(() => response);
+        return response;
+    }});
+    if (cached) {{
+        event.waitUntil(refresh.catch(() => null));
+        return cached;
+    }}
+    return refresh;
+}}
+
+// Thumbnail URLs carry the file version, so a cached copy never goes stale
+async function cachedThumbnail(event) {{
+    const cache = await caches.open(THUMB_CACHE);
+    const cached = await cache.match(event.request);
+    if (cached) return cached;
+    const response = await fetch(event.request);
+    if (response.ok) {{
+        event.waitUntil(cache.put(event.request, response.clone()).then(trimThumbnails));
+    }}
+    return response;
+}}
+
+// Drops the oldest thumbnails past THUMB_MAX_BYTES, once per burst of gallery scrolling
+function trimThumbnails() {{
+    if (trimming) return trimming;
+    trimming = new Promise(resolve => setTimeout(resolve, 2000)).then(async () => {{
+        const cache = await caches.open(THUMB_CACHE);
+        const requests = await cache.keys();
+        const sizes = await Promise.all(requests.map(request => cache.match(request).then(
+            response => parseInt(response && response.headers.get('content-length')) || 0)));
+        let total = sizes.reduce((sum, size) => sum + size, 0);
+        if (total <= THUMB_MAX_BYTES) return;
+        // Keys come back oldest first, and trimming to 90% saves doing it again for every image
+        for (let i = 0; i < requests.length && total > THUMB_MAX_BYTES * 0.9; i++) {{
+            await cache.delete(requests[i]);
+            total -= sizes[i];
+        }}
+    }}).finally(() => {{
+        trimming = null;
+    }});
+    return trimming;
+}}
+
+// Menus come from the PC when it answers and from the last copy when it does not
+async function networkFirst(request) {{
+    const cache = await caches.open(DATA_CACHE);
+    const controller = new AbortController();
+    const timer = setTimeout(() => controller.abort(), NETWORK_TIMEOUT);
+    try {{
+        const response = await fetch(request, {{signal: controller.signal}});
+        if (response.ok) await cache.put(request, response.clone());
+        return response;
+    }} catch (error) {{
+        const cached = await cache.match(request);
+        if (!cached) throw error;
+        const headers = new Headers(cached.headers);
+        headers.set('X-Offline-Copy', '1');
+        return new Response(cached.body, {{status: cached.status, headers}});
+    }} finally {{
+        clearTimeout(timer);
+    }}
+}}
+"""
+
+# Response encodings of the precompressed UI, best first, keyed by file suffix
+UI_ENCODINGS = {{".br": "br", ".gz": "gzip"}}
+
+def minify_css(css):
+    css = re.sub(r"/\\*.*?\\*/", "", css, flags=re.S)
+    css = re.sub(r"\\s+", " ", css)
+    css = re.sub(r"\\s*([{{}};,>])\\s*", r"\\1", css)
+    return re.sub(r":\\s+", ":", css).replace(";}}", "}}").strip()
+
+def minify_lines(text, comments=None):
+    """Drop indentation, blank lines and whole-line comments.
+
+    Lines are never joined, so automatic semicolon insertion and template
+    literals in the script behave exactly as they did before.
+    """
+    lines = (line.strip() for line in text.splitlines())
+    return "\\n".join(line for line in lines if line and not (comments and line.startswith(comments)))
+
+def compress_variants(data):
+    """{{suffix: bytes}} - the data itself, gzip, and brotli when it is installed"""
+    variants = {{"": data, ".gz": gzip.compress(data, 9, mtime=0)}}
+    if brotli is not None:
+        variants[".br"] = brotli.compress(data, quality=11)
+    return variants
+
+def write_ui_asset(directory, stem, suffix, data, compress=True):
+    """Store data under a name carrying its content hash, with precompressed siblings"""
+    name = f"{{stem}}.{{hashlib.sha256(data).hexdigest()[:12]}}{{suffix}}"
+    variants = compress_variants(data) if compress else {{"": data}}
+    # Same hash, same bytes - a previous start already wrote every variant
+    if not all((directory / (name + variant)).exists() for variant in variants):
+        for variant, content in variants.items():
+            temp_path = directory / f"{{name}}{{variant}}.{{os.getpid()}}.tmp"
+            temp_path.write_bytes(content)
+            os.replace(temp_path, directory / (name + variant))
+    return name
+
+def build_ui_assets(html, directory):
+    """Split the UI into a small HTML shell plus content-addressed CSS and JS files.
+
+    Returns (shell variants, {{asset name: media type}}, {{icon size: asset name}}).
+    Builds left over from older versions of the page are removed.
+    """
+    directory.mkdir(parents=True, exist_ok=True)
+    style = re.search(r"<style>(.*?)</style>", html, re.S)
+    script = re.search(r"<script>(.*?)</script>", html, re.S)
+    css = write_ui_asset(directory, "app", ".css", minify_css(style.group(1)).encode('utf-8'))
+    js = write_ui_asset(directory, "app", ".js", minify_lines(script.group(1), "//").encode('utf-8'))
+    icons = {{size: write_ui_asset(directory, f"icon-{{size}}", ".png", render_app_icon(size), compress=False)
+             for size in APP_ICON_SIZES}}
+
+    shell = (html[:style.start()] + f'<link rel="stylesheet" href="/ui/{{css}}">' +
+             f'<link rel="apple-touch-icon" href="/ui/{{icons[APP_ICON_SIZES[0]]}}">' +
+             html[style.end():script.start()] + f'<script src="/ui/{{js}}"></script>' + html[script.end():])
+    assets = {{css: "text/css; charset=utf-8", js: "text/javascript; charset=utf-8"}}
+    assets.update({{name: "image/png" for name in icons.values()}})
+
+    current = {{name + suffix for name in assets for suffix in ["", *UI_ENCODINGS]}}
+    for entry in os.scandir(directory):
+        if entry.name not in current:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+    return compress_variants(minify_lines(shell).encode('utf-8')), assets, icons
+
+def render_app_icon(size):
+    """PNG app icon - a picture on the page background, kept inside the maskable safe zone"""
+    from PIL import ImageDraw
+    img = Image.new("RGB", (size, size), (26, 26, 26))
+    draw = ImageDraw.Draw(img)
+    unit = size / 100
+    draw.rounded_rectangle([22 * unit, 26 * unit, 78 * unit, 74 * unit], radius=6 * unit, fill=(0, 122, 255))
+    draw.polygon([(28 * unit, 68 * unit), (44 * unit, 44 * unit), (56 * unit, 60 * unit),
+                  (63 * unit, 51 * unit), (72 * unit, 68 * unit)], fill=(255, 255, 255))
+    draw.ellipse([60 * unit, 32 * unit, 69 * unit, 41 * unit], fill=(255, 255, 255))
+    buffer = BytesIO()
+    img.save(buffer, "PNG", optimize=True)
+    return buffer.getvalue()
+
+def build_service_worker(shell, assets):
+    """SERVICE_WORKER_JS for this build - a new page means new bytes, which is what makes phones update"""
+    precache = ["/"] + [f"/ui/{{name}}" for name in assets]
+    return (SERVICE_WORKER_JS
+            .replace("__VERSION__", hashlib.sha256(shell[""]).hexdigest()[:12])
+            .replace("__PRECACHE__", json.dumps(precache))
+            .replace("__THUMB_MAX_BYTES__", str(OFFLINE_THUMB_MAX_BYTES))).encode('utf-8')
+
+def build_web_manifest(icons):
+    return json.dumps({{
+        "name": "ComfyUI Mobile",
+        "short_name": "ComfyUI",
+        "start_url": "/",
+        "scope": "/",
+        "display": "standalone",
+        "background_color": "#1a1a1a",
+        "theme_color": "#1a1a1a",
+        "icons": [{{"src": f"/ui/{{name}}", "sizes": f"{{size}}x{{size}}", "type": "image/png", "purpose": "any maskable"}}
+                  for size, name in icons.items()]
+    }}).encode('utf-8')
+
+def pick_encoding(request, suffixes):
+    """Suffix of the best precompressed variant the browser accepts, or "" for plain"""
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.strip().lower().partition(";")
+        if params.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.add(coding)
+    for suffix, coding in UI_ENCODINGS.items():
+        if suffix in suffixes and (coding in accepted or "*" in accepted):
+            return suffix
+    return ""
+
+ui_shell = None
+ui_shell_etag = None
+ui_shell_mtime = 0
+ui_assets = {{}}
+ui_service_worker = None
+ui_manifest = None
+
+@app.on_event("startup")
+async def build_mobile_ui():
+    global ui_shell, ui_shell_etag, ui_shell_mtime, ui_assets, ui_service_worker, ui_manifest
+    ui_shell, ui_assets, icons = await asyncio.to_thread(build_ui_assets, MOBILE_UI_HTML, UI_ASSET_DIR)
+    ui_shell_etag = f'"{{hashlib.sha256(ui_shell[""]).hexdigest()[:16]}}"'
+    ui_shell_mtime = os.path.getmtime(__file__)
+    ui_service_worker = build_service_worker(ui_shell, ui_assets)
+    ui_manifest = build_web_manifest(icons)
+
+@app.get("/", response_class=HTMLResponse)
+async def get_mobile_ui(request: Request):
+    # The shell is all that revalidates - a 304 unless the script itself changed
+    headers = {{
+        "ETag": ui_shell_etag,
+        "Last-Modified": formatdate(ui_shell_mtime, usegmt=True),
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding"
+    }}
+    if is_not_modified(request, ui_shell_etag, ui_shell_mtime):
+        return Response(status_code=304, headers=headers)
+    suffix = pick_encoding(request, ui_shell)
+    if suffix:
+        headers["Content-Encoding"] = UI_ENCODINGS[suffix]
+    return Response(content=ui_shell[suffix], media_type="text/html; charset=utf-8", headers=headers)
+
+@app.get("/sw.js")
+async def get_service_worker():
+    # Served from the root so it controls the whole page, and revalidated so phones see updates
+    return Response(content=ui_service_worker, media_type="text/javascript; charset=utf-8",
+                    headers={{"Cache-Control": "no-cache"}})
+
+@app.get("/manifest.webmanifest")
+async def get_web_manifest():
+    return Response(content=ui_manifest, media_type="application/manifest+json",
+                    headers={{"Cache-Control": "no-cache"}})
+
+@app.get("/ui/{{name}}")
+async def get_ui_asset(name: str, request: Request):
+    media_type = ui_assets.get(name)
+    if media_type is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    suffix = pick_encoding(request, [suffix for suffix in UI_ENCODINGS if (UI_ASSET_DIR / (name + suffix)).exists()])
+    # Content-addressed, so the browser can keep it until the page links a new name
+    headers = {{"Cache-Control": IMMUTABLE_CACHE, "Vary": "Accept-Encoding"}}
+    if suffix:
+        headers["Content-Encoding"] = UI_ENCODINGS[suffix]
+    return FileResponse(UI_ASSET_DIR / (name + suffix), media_type=media_type, headers=headers)
+
+class JobStore:
+    """Job table with a size cap, TTL and LRU eviction of finished jobs.
+
+    Every change is appended to a compact JSON-lines journal, so a restart
+    recovers in-progress jobs with their comfy_prompt_id and phones can keep
+    asking about the job_ids they hold.
+    """
+
+    def __init__(self, path, max_entries, ttl, stale_age):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_age = stale_age
+        self.jobs = OrderedDict()
+        self.journal = None
+        self.journal_lines = 0
+        self.load()
+        # Expired jobs are only dropped from memory here, compact() writes what is left
+        self.evict()
+        self.compact()
+
+    def load(self):
+        if not self.path.exists():
+            return
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # torn write from a crash
+                job_id = record.pop("id")
+                if record.get("deleted"):
+                    self.jobs.pop(job_id, None)
+                else:
+                    self.jobs[job_id] = record
+        in_progress = sum(1 for job in self.jobs.values() if not job.get("finished"))
+        if self.jobs:
+            print(f"Recovered {{len(self.jobs)}} jobs ({{in_progress}} still in progress)")
+
+    def compact(self):
+        """Rewrite the journal with one line per live job"""
+        temp_path = self.path.with_suffix(".tmp")
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for job_id, job in self.jobs.items():
+                f.write(self.record(job_id, job))
+        os.replace(temp_path, self.path)
+        self.journal_lines = len(self.jobs)
+        self.journal = open(self.path, 'a', encoding='utf-8')
+
+    def close(self):
+        self.journal.close()
+
+    def record(self, job_id, job):
+        return json.dumps({{"id": job_id, **job}}, separators=(',', ':')) + "\\n"
+
+    def write(self, line):
+        self.journal.write(line)
+        self.journal.flush()
+        self.journal_lines += 1
+        if self.journal_lines > 2 * len(self.jobs) + 1000:
+            self.journal.close()
+            self.compact()
+
+    def __contains__(self, job_id):
+        return job_id in self.jobs
+
+    def __getitem__(self, job_id):
+        job = self.jobs[job_id]
+        self.jobs.move_to_end(job_id)
+        return job
+
+    def __setitem__(self, job_id, job):
+        self.jobs[job_id] = job
+        self.jobs.move_to_end(job_id)
+        self.write(self.record(job_id, job))
+        self.evict()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def values(self):
+        return self.jobs.values()
+
+    def update(self, job_id, **fields):
+        """Change a job and journal it; finishing a job starts its TTL"""
+        job = self.jobs[job_id]
+        job.update(fields)
+        if job.get("status") in ("completed", "failed") and not job.get("finished"):
+            job["finished"] = time.time()
+        self.write(self.record(job_id, job))
+
+    def remove(self, job_id):
+        del self.jobs[job_id]
+        if self.journal:
+            self.write(json.dumps({{"id": job_id, "deleted": True}}) + "\\n")
+
+    def evict(self):
+        now = time.time()
+        for job_id, job in list(self.jobs.items()):
+            finished = job.get("finished")
+            if finished and now - finished > self.ttl:
+                self.remove(job_id)
+            elif not finished and now - job.get("submitted", now) > self.stale_age:
+                self.remove(job_id)
+
+        while len(self.jobs) > self.max_entries:
+            # Least recently used finished job first, oldest unfinished only as a last resort
+            victim = next((job_id for job_id, job in self.jobs.items() if job.get("finished")), None)
+            self.remove(victim if victim is not None else next(iter(self.jobs)))
+
+jobs = None
+
+@app.on_event("startup")
+async def start_job_store():
+    global jobs
+    jobs = JobStore(JOBS_JOURNAL_PATH, JOB_MAX_ENTRIES, JOB_TTL, JOB_STALE_AGE)
+
+@app.on_event("shutdown")
+async def stop_job_store():
+    jobs.close()
+
+def persistent_client_id():
+    """ComfyUI sends progress only to the submitting client_id, so keep ours across restarts"""
     try:
-        response = requests.get(f"http://{{COMFYUI_HOST}}:{{COMFYUI_PORT}}/object_info", timeout=10)
-        if response.status_code == 200:
-            object_info = response.json()
-            checkpoints = []
-            if "CheckpointLoaderSimple" in object_info:
-                checkpoint_info = object_info["CheckpointLoaderSimple"]["input"]["required"]["ckpt_name"]
-                if isinstance(checkpoint_info, list) and len(checkpoint_info) > 0:
-                    checkpoints = checkpoint_info[0]
-            return checkpoints
-        else:
-            return ["mopMixtureOfPerverts_v31.safetensors"]
-    except Exception as e:
-        return ["mopMixtureOfPerverts_v31.safetensors"]
+        client_id = COMFYUI_CLIENT_ID_PATH.read_text().strip()
+        if client_id:
+            return client_id
+    except OSError:
+        pass
+    client_id = uuid.uuid4().hex
+    COMFYUI_CLIENT_ID_PATH.write_text(client_id)
+    return client_id
 
-@app.get("/api/gallery")
-async def get_gallery(offset: int = 0, limit: int = 20):
+def encode_preview(data):
+    """A preview frame as a JPEG data URL no larger than PREVIEW_MAX_SIZE, or "" if it can't be read"""
     try:
-        image_paths = []
-        
-        if COMFYUI_OUTPUT_DIR.exists():
-            for ext in ['*.png', '*.jpg', '*.jpeg', '*.webp']:
-                found_images = list(COMFYUI_OUTPUT_DIR.glob(ext))
-                image_paths.extend(found_images)
-        
-        if OUTPUT_DIR.exists():
-            for ext in ['*.png', '*.jpg', '*.jpeg', '*.webp']:
-                local_images = list(OUTPUT_DIR.glob(ext))
-                image_paths.extend(local_images)
-        
-        image_paths.sort(key=lambda x: x.stat().st_mtime, reverse=True)
-        
-        total = len(image_paths)
-        paginated_paths = image_paths[offset:offset + limit]
-        
-        images = []
-        for path in paginated_paths:
+        with Image.open(BytesIO(data)) as img:
+            if img.format == "JPEG" and max(img.size) <= PREVIEW_MAX_SIZE:
+                # Already small enough - passed on without decoding at all
+                jpeg = data
+            else:
+                img.draft('RGB', (PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE))
+                img = img.convert("RGB")
+                img.thumbnail((PREVIEW_MAX_SIZE, PREVIEW_MAX_SIZE), Image.Resampling.BILINEAR)
+                buffer = BytesIO()
+                img.save(buffer, "JPEG", quality=PREVIEW_QUALITY)
+                jpeg = buffer.getvalue()
+    except Exception as e:
+        print(f"Could not read a preview frame: {{e}}")
+        return ""
+    return "data:image/jpeg;base64," + base64.b64encode(jpeg).decode('ascii')
+
+class ComfyEventBridge:
+    """Keeps one WebSocket open to ComfyUI's /ws and fans its events out per prompt.
+
+    Browsers subscribe through /api/events/{{job_id}}; nothing polls ComfyUI while it runs.
+    """
+
+    def __init__(self, url, snapshot):
+        self.url = url
+        self.snapshot = snapshot
+        self.client_id = persistent_client_id()
+        self.subscribers = {{}}
+        self.progress = {{}}
+        self.previews = {{}}  # prompt_id -> [frame number, image bytes, data URL once encoded]
+        self.preview_count = 0
+        self.current_prompt = None
+        self.connected = False
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def run(self):
+        delay = 1
+        while True:
             try:
-                stat = path.stat()
-                settings = extract_metadata_from_image(path)
-                
-                images.append({{
-                    "filename": path.name,
-                    "path": str(path),
-                    "size": f"{{stat.st_size // 1024}}KB",
-                    "date": stat.st_mtime,
-                    "settings": settings
-                }})
+                async with websockets.connect(f"{{self.url}}?clientId={{self.client_id}}", max_size=None) as ws:
+                    self.connected = True
+                    delay = 1
+                    # Anything may have happened while we were away - let watchers re-check
+                    for prompt_id in list(self.subscribers):
+                        self.publish(prompt_id, {{"type": "resync", "data": {{}}}})
+                    async for message in ws:
+                        if isinstance(message, str):
+                            self.handle(json.loads(message))
+                        else:
+                            self.handle_preview(message)
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                continue
-        
-        for img in images:
+                if self.connected:
+                    print(f"ComfyUI event stream lost: {{e}}")
+            self.connected = False
+            self.current_prompt = None
+            self.previews.clear()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    def handle(self, message):
+        event_type = message.get("type")
+        data = message.get("data") or {{}}
+        prompt_id = data.get("prompt_id")
+
+        if event_type == "execution_start":
+            self.current_prompt = prompt_id
+            self.snapshot.poke()
+        elif event_type == "executing":
+            if data.get("node") is None:
+                self.current_prompt = None
+                self.progress.pop(prompt_id, None)
+                self.previews.pop(prompt_id, None)
+                self.snapshot.prefetch(prompt_id)
+                self.snapshot.poke()
+            else:
+                self.current_prompt = prompt_id
+        elif event_type == "progress":
+            # Older ComfyUI builds leave prompt_id out of progress events
+            prompt_id = prompt_id or self.current_prompt
+            self.progress[prompt_id] = {{"value": data.get("value", 0), "max": data.get("max", 1)}}
+        elif event_type in ("execution_error", "execution_interrupted"):
+            self.progress.pop(prompt_id, None)
+            self.previews.pop(prompt_id, None)
+
+        if prompt_id:
+            self.publish(prompt_id, {{"type": event_type, "data": data}})
+
+    def handle_preview(self, message):
+        """Keep only the newest preview frame of each watched prompt.
+
+        Binary frames start with a 4-byte event type: 1 is a bare preview (then a
+        4-byte image format), 4 carries a JSON header naming the prompt.
+        """
+        if len(message) < 8:
+            return
+        event_type = int.from_bytes(message[:4], "big")
+        if event_type == 1:
+            prompt_id, image = self.current_prompt, message[8:]
+        elif event_type == 4:
+            length = int.from_bytes(message[4:8], "big")
             try:
-                from datetime import datetime
-                img["date"] = datetime.fromtimestamp(img["date"]).strftime("%m/%d %H:%M")
-            except:
-                img["date"] = "Unknown"
-        
+                metadata = json.loads(message[8:8 + length])
+            except ValueError:
+                return
+            prompt_id, image = metadata.get("prompt_id") or self.current_prompt, message[8 + length:]
+        else:
+            return
+        # Frames nobody is watching are dropped without being decoded
+        if prompt_id in self.subscribers:
+            self.preview_count += 1
+            self.previews[prompt_id] = [self.preview_count, image, None]
+
+    async def latest_preview(self, prompt_ids, after):
+        """(frame number, data URL) of the newest preview of prompt_ids past frame after, or None.
+
+        Each frame is encoded once however many phones watch it.
+        """
+        frames = [self.previews[prompt_id] for prompt_id in prompt_ids if prompt_id in self.previews]
+        if not frames:
+            return None
+        frame = max(frames, key=lambda frame: frame[0])
+        if frame[0] <= after:
+            return None
+        if frame[2] is None:
+            frame[2] = await asyncio.to_thread(encode_preview, frame[1])
+        return (frame[0], frame[2]) if frame[2] else None
+
+    def publish(self, prompt_id, event):
+        for events in self.subscribers.get(prompt_id, ()):
+            if events.full():
+                events.get_nowait()
+            events.put_nowait(event)
+
+    def subscribe(self, prompt_ids):
+        """One event queue fed by every prompt in prompt_ids"""
+        events = asyncio.Queue(maxsize=100)
+        for prompt_id in prompt_ids:
+            self.subscribers.setdefault(prompt_id, set()).add(events)
+        return events
+
+    def unsubscribe(self, prompt_ids, events):
+        for prompt_id in prompt_ids:
+            watchers = self.subscribers.get(prompt_id)
+            if watchers:
+                watchers.discard(events)
+                if not watchers:
+                    del self.subscribers[prompt_id]
+                    self.previews.pop(prompt_id, None)
+
+    def live_progress(self, prompt_id):
+        """Step-accurate progress for a running prompt, or None if no step was reported yet"""
+        progress = self.progress.get(prompt_id)
+        if not progress or not progress["max"]:
+            return None
+        return {{
+            "progress": int(progress["value"] / progress["max"] * 100),
+            "step": progress["value"],
+            "steps": progress["max"]
+        }}
+
+class ComfyQueueSnapshot:
+    """One background poller of ComfyUI's /queue shared by every status request.
+
+    Polls quickly while anything is queued or running and backs off when idle, so
+    upstream load does not grow with the number of phones watching. History entries
+    carry whole workflows, so they are fetched one prompt at a time as it finishes.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.running = []
+        self.pending = []
+        self.history = {{}}
+        self.updated = 0
+        self.error = None
+        self.wake = asyncio.Event()
+        self.waiters = []
+        self.lookups = {{}}
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    def busy(self):
+        return bool(self.running or self.pending) or any(
+            job["status"] == "processing" and comfy_backends.of(job) is self.backend for job in jobs.values()
+        )
+
+    def poke(self):
+        """Ask for an early refresh, e.g. after a submit or a finished prompt"""
+        self.wake.set()
+
+    async def sync(self):
+        """Wait for a refresh that starts after this call"""
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self.wake.set()
+        await asyncio.wait_for(waiter, 30)
+
+    async def run(self):
+        while True:
+            waiters, self.waiters = self.waiters, []
+            self.wake.clear()
+            try:
+                await self.refresh()
+                self.error = None
+            except Exception as e:
+                self.error = str(e)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+            await asyncio.sleep(QUEUE_POLL_MIN_INTERVAL)
+            interval = QUEUE_POLL_ACTIVE_INTERVAL if self.busy() else QUEUE_POLL_IDLE_INTERVAL
+            try:
+                await asyncio.wait_for(self.wake.wait(), max(0, interval - QUEUE_POLL_MIN_INTERVAL))
+            except asyncio.TimeoutError:
+                pass
+
+    async def refresh(self):
+        started = time.time()
+        response = await self.backend.client.get("/queue", timeout=10)
+        response.raise_for_status()
+        # Queued items carry their workflows too, so parse off the event loop
+        queue_data = await asyncio.to_thread(json.loads, response.content)
+        running = [item[1] for item in queue_data.get("queue_running", []) if len(item) > 1]
+        pending = [item[1] for item in queue_data.get("queue_pending", []) if len(item) > 1]
+        finished = set(self.running + self.pending) - set(running + pending)
+        self.running, self.pending = running, pending
+        self.updated = started
+        for prompt_id in finished:
+            self.prefetch(prompt_id)
+
+    def prefetch(self, prompt_id):
+        """Start fetching the history of a prompt that just finished"""
+        if prompt_id and prompt_id not in self.history and prompt_id not in self.lookups:
+            asyncio.ensure_future(self.quiet_lookup(prompt_id))
+
+    async def quiet_lookup(self, prompt_id):
+        try:
+            await self.lookup_history(prompt_id)
+        except Exception:
+            pass  # whoever asks for the status next looks it up again
+
+    async def lookup_history(self, prompt_id):
+        """Fetch one prompt's history, once however many requests ask for it at the same time"""
+        if prompt_id in self.history:
+            return self.history[prompt_id]
+        if prompt_id in self.lookups:
+            return await asyncio.shield(self.lookups[prompt_id])
+        lookup = asyncio.ensure_future(self.fetch_history(prompt_id))
+        self.lookups[prompt_id] = lookup
+        try:
+            return await lookup
+        finally:
+            del self.lookups[prompt_id]
+
+    async def fetch_history(self, prompt_id):
+        response = await self.backend.client.get(f"/history/{{prompt_id}}", timeout=10)
+        if response.status_code != 200:
+            return None
+        entry = response.json().get(prompt_id)
+        if entry is not None:
+            # A finished prompt's entry never changes - keep the newest ones around
+            self.history[prompt_id] = entry
+            while len(self.history) > QUEUE_HISTORY_ITEMS:
+                del self.history[next(iter(self.history))]
+        return entry
+
+CATALOG_FIELDS = {{
+    "checkpoints": ("CheckpointLoaderSimple", "ckpt_name"),
+    "samplers": ("KSampler", "sampler_name"),
+    "schedulers": ("KSampler", "scheduler"),
+    "loras": ("LoraLoader", "lora_name"),
+    "vaes": ("VAELoader", "vae_name"),
+}}
+
+def object_info_choices(object_info, node, field):
+    """Pull a combo input's options out of /object_info, old or new layout"""
+    try:
+        spec = object_info[node]["input"]["required"][field]
+    except (KeyError, TypeError):
+        return []
+    if isinstance(spec, list) and spec:
+        if isinstance(spec[0], list):
+            return spec[0]
+        if spec[0] == "COMBO" and len(spec) > 1 and isinstance(spec[1], dict):
+            return spec[1].get("options", [])
+    return []
+
+class ModelCatalog:
+    """Models, samplers, schedulers, LoRAs and VAEs extracted once from ComfyUI's /object_info.
+
+    Refetched after CATALOG_TTL or on demand; served with an ETag so unchanged
+    catalogs cost phones a 304 and cost ComfyUI nothing.
+    """
+
+    def __init__(self, ttl, backend=None):
+        self.ttl = ttl
+        self.backend = backend
+        self.catalog = None
+        self.etag = None
+        self.fetched = 0
+        self.lock = asyncio.Lock()
+
+    async def get(self, refresh=False):
+        if not refresh and self.catalog and time.time() - self.fetched < self.ttl:
+            return self.catalog
+        async with self.lock:
+            # Another request may have refreshed while we waited
+            if not refresh and self.catalog and time.time() - self.fetched < self.ttl:
+                return self.catalog
+            try:
+                response = await self.backend.client.get("/object_info", timeout=30)
+                response.raise_for_status()
+                object_info = response.json()
+                catalog = {{name: object_info_choices(object_info, node, field)
+                           for name, (node, field) in CATALOG_FIELDS.items()}}
+                catalog["connected"] = True
+            except Exception as e:
+                print(f"Could not refresh model catalog: {{e}}")
+                if self.catalog:
+                    # Keep serving what we had, flagged as stale
+                    catalog = {{**self.catalog, "connected": False}}
+                else:
+                    catalog = {{name: [] for name in CATALOG_FIELDS}}
+                    catalog["checkpoints"] = ["mopMixtureOfPerverts_v31.safetensors"]
+                    catalog["connected"] = False
+                # Retry sooner than a full TTL while ComfyUI is unreachable
+                self.fetched = time.time() - self.ttl + CATALOG_RETRY_INTERVAL
+            else:
+                self.fetched = time.time()
+            self.set(catalog)
+            return self.catalog
+
+    def set(self, catalog):
+        if catalog != self.catalog:
+            self.catalog = catalog
+            digest = hashlib.sha1(json.dumps(catalog, sort_keys=True).encode('utf-8')).hexdigest()
+            self.etag = f'"{{digest[:20]}}"'
+
+def etag_response(request, payload, etag):
+    """JSON response that phones must revalidate, answered with 304 while unchanged"""
+    headers = {{"ETag": etag, "Cache-Control": "no-cache"}}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload, headers=headers)
+
+class ComfyBackend:
+    """One ComfyUI server with its own connection pool, event bridge, queue snapshot and model catalog"""
+
+    def __init__(self, name, url, output_dir=None):
+        self.name = name
+        self.url = url.rstrip("/")
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.client = None
+        self.snapshot = ComfyQueueSnapshot(self)
+        self.events = ComfyEventBridge(self.url.replace("http", "ws", 1) + "/ws", self.snapshot)
+        self.catalog = ModelCatalog(CATALOG_TTL, self)
+        self.dispatched = []  # (time, prompts) sent here that the snapshot may not list yet
+
+    def start(self):
+        self.client = httpx.AsyncClient(
+            base_url=self.url,
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=COMFYUI_MAX_CONNECTIONS,
+                max_keepalive_connections=COMFYUI_MAX_CONNECTIONS
+            )
+        )
+        self.events.start()
+        self.snapshot.start()
+
+    async def stop(self):
+        await self.events.stop()
+        await self.snapshot.stop()
+        await self.client.aclose()
+
+    def healthy(self):
+        """Reachable at the last queue snapshot - snapshots keep polling idle backends too"""
+        return self.snapshot.error is None
+
+    def load(self):
+        """Prompts running or waiting here, counting ones submitted since the last snapshot"""
+        self.dispatched = [(at, count) for at, count in self.dispatched if at >= self.snapshot.updated]
+        return len(self.snapshot.running) + len(self.snapshot.pending) + sum(count for at, count in self.dispatched)
+
+    def has_checkpoint(self, checkpoint):
+        catalog = self.catalog.catalog
+        # Until ComfyUI answered once we can't know, so don't rule the backend out
+        if checkpoint is None or not catalog or not catalog["connected"]:
+            return True
+        return checkpoint in catalog["checkpoints"]
+
+    def describe(self):
         return {{
+            "name": self.name,
+            "url": self.url,
+            "healthy": self.healthy(),
+            "connected": self.events.connected,
+            "load": self.load(),
+            "error": self.snapshot.error
+        }}
+
+class BackendPool:
+    """Every ComfyUI in COMFYUI_BACKENDS. Jobs go to the least loaded reachable one that
+    has their checkpoint and remember it, so status, events and images follow them.
+    """
+
+    def __init__(self, backends):
+        self.backends = {{name: ComfyBackend(name, **options) for name, options in backends.items()}}
+        self.default = next(iter(self.backends.values()))
+
+    def start(self):
+        for backend in self.backends.values():
+            backend.start()
+
+    async def stop(self):
+        for backend in self.backends.values():
+            await backend.stop()
+
+    def of(self, job):
+        """The backend a job was sent to - jobs journaled before the pool ran on the first one"""
+        return self.backends.get(job.get("backend"), self.default)
+
+    async def pick(self, checkpoint):
+        healthy = [backend for backend in self.backends.values() if backend.healthy()]
+        if not healthy:
+            raise HTTPException(status_code=503, detail="Cannot connect to ComfyUI - is it running?")
+        await asyncio.gather(*(backend.catalog.get() for backend in healthy))
+        candidates = [backend for backend in healthy if backend.has_checkpoint(checkpoint)]
+        if not candidates:
+            # The model may have been added since the catalogs were read
+            await asyncio.gather(*(backend.catalog.get(refresh=True) for backend in healthy))
+            candidates = [backend for backend in healthy if backend.has_checkpoint(checkpoint)]
+        if not candidates:
+            # Nobody lists it - let ComfyUI itself explain what is wrong with the request
+            candidates = healthy
+        # Ties go to the backend listed first
+        return min(candidates, key=lambda backend: backend.load())
+
+def merge_catalogs(catalogs):
+    """Options of every reachable backend, each listed once in first-seen order"""
+    live = [catalog for catalog in catalogs if catalog["connected"]] or catalogs[:1]
+    merged = {{name: list(dict.fromkeys(option for catalog in live for option in catalog[name]))
+              for name in CATALOG_FIELDS}}
+    merged["connected"] = any(catalog["connected"] for catalog in catalogs)
+    return merged
+
+class PoolCatalog(ModelCatalog):
+    """The catalogs of all backends as one, so phones can pick any model the pool can run"""
+
+    def __init__(self, pool):
+        super().__init__(CATALOG_TTL)
+        self.pool = pool
+
+    async def get(self, refresh=False):
+        backends = list(self.pool.backends.values())
+        # Backends that are down would only stall the catalog until their connect timeout
+        backends = [backend for backend in backends if backend.healthy()] or backends
+        catalogs = await asyncio.gather(*(backend.catalog.get(refresh=refresh) for backend in backends))
+        self.set(merge_catalogs(catalogs))
+        return self.catalog
+
+comfy_backends = None
+model_catalog = None
+
+@app.on_event("startup")
+async def start_comfy_backends():
+    global comfy_backends, model_catalog
+    comfy_backends = BackendPool(COMFYUI_BACKENDS)
+    model_catalog = PoolCatalog(comfy_backends)
+    comfy_backends.start()
+
+@app.on_event("shutdown")
+async def stop_comfy_backends():
+    await comfy_backends.stop()
+
+@app.get("/api/models")
+async def get_models(request: Request):
+    catalog = await model_catalog.get()
+    return etag_response(request, catalog["checkpoints"], model_catalog.etag[:-1] + '-models"')
+
+@app.get("/api/catalog")
+async def get_catalog(request: Request, refresh: bool = False):
+    catalog = await model_catalog.get(refresh=refresh)
+    return etag_response(request, catalog, model_catalog.etag)
+
+@app.post("/api/catalog/refresh")
+async def refresh_catalog():
+    return await model_catalog.get(refresh=True)
+
+@app.get("/api/templates")
+async def get_templates():
+    return {{"templates": await asyncio.to_thread(workflow_templates.list)}}
+
+def encode_cursor(key):
+    """Opaque page cursor for a (mtime, path) sort key"""
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii').rstrip("=")
+
+def decode_cursor(cursor):
+    try:
+        mtime, path = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return float(mtime), str(path)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid gallery cursor")
+
+@app.get("/api/gallery")
+async def get_gallery(cursor: Optional[str] = None, limit: int = 20, collapse: bool = False):
+    after = decode_cursor(cursor) if cursor else None
+    limit = max(1, min(limit, GALLERY_PAGE_MAX))
+    hashes = require_perceptual_index() if collapse else None
+    try:
+        seq = gallery_index.seq
+        if collapse:
+            images, last = await asyncio.to_thread(gallery_index.collapsed_page, hashes, after, limit)
+        else:
+            images, last = await asyncio.to_thread(gallery_index.page, after, limit)
+
+        result = {{
             "images": images,
-            "total": total,
-            "has_more": offset + limit < total
+            "next_cursor": encode_cursor(last) if last else None,
+            "has_more": last is not None,
+            "seq": seq
         }}
+        if after is None:
+            # Counting walks the whole index, so only the first page pays for it
+            result["total"] = await asyncio.to_thread(gallery_index.count)
+            if collapse:
+                result["groups"] = int((await asyncio.to_thread(hashes.duplicate_groups))[1].sum())
+        return result
         
     except Exception as e:
-        return {{"images": [], "total": 0, "has_more": False}}
+        return {{"images": [], "total": 0, "next_cursor": None, "has_more": False, "seq": 0}}
+
+@app.get("/api/gallery/search")
+async def search_gallery(q: str = "", cursor: Optional[str] = None, limit: int = 20):
+    after = decode_cursor(cursor) if cursor else None
+    limit = max(1, min(limit, GALLERY_PAGE_MAX))
+    try:
+        seq = gallery_index.seq
+        images, last = await asyncio.to_thread(gallery_index.search, q, after, limit)
+        result = {{
+            "images": images,
+            "next_cursor": encode_cursor(last) if last else None,
+            "has_more": last is not None,
+            "seq": seq
+        }}
+        if after is None:
+            result["total"] = await asyncio.to_thread(gallery_index.count_matching, q)
+        return result
+    except sqlite3.OperationalError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid search: {{e}}")
 
-@app.get("/api/gallery/thumb/{{filename}}")
-async def get_thumbnail(filename: str):
-    return await get_gallery_image(filename, thumbnail=True)
+def require_perceptual_index():
+    if perceptual_index is None:
+        raise HTTPException(status_code=503, detail="Similar images need numpy installed")
+    return perceptual_index
 
-@app.get("/api/gallery/full/{{filename}}")
-async def get_full_image(filename: str):
-    return await get_gallery_image(filename, thumbnail=False)
+@app.get("/api/gallery/similar/{{image_id:path}}")
+async def get_similar_images(image_id: str, distance: int = SIMILAR_MAX_DISTANCE, limit: int = 40):
+    """Images whose perceptual hash is within distance bits of this one's, closest first"""
+    hashes = require_perceptual_index()
+    image_path = await asyncio.to_thread(resolve_gallery_id, image_id)
+    if not image_path:
+        raise HTTPException(status_code=404, detail="Image not found")
+    row = await asyncio.to_thread(gallery_index.hash_of, str(image_path))
+    if row is None:
+        raise HTTPException(status_code=404, detail="Image not indexed yet")
+    rowid, phash = row
+    if phash is None:
+        raise HTTPException(status_code=422, detail="Image could not be hashed")
 
-async def get_gallery_image(filename: str, thumbnail: bool = False):
+    limit = max(1, min(limit, GALLERY_PAGE_MAX))
+    matches = await asyncio.to_thread(hashes.similar, phash, max(0, min(distance, 64)), limit, rowid)
+    images = await asyncio.to_thread(gallery_index.rows_by_id, [rowid for rowid, _ in matches])
+    for image, (_, bits) in zip(images, matches):
+        image["distance"] = bits
+    return {{"images": images, "next_cursor": None, "has_more": False, "seq": gallery_index.seq}}
+
+@app.get("/api/gallery/changes")
+async def get_gallery_changes(since: int = 0):
     try:
-        possible_paths = [
-            COMFYUI_OUTPUT_DIR / filename,
-            OUTPUT_DIR / filename,
-        ]
-        
-        image_path = None
-        for path in possible_paths:
-            if path.exists():
-                image_path = path
-                break
+        images, deleted, seq, reset = await asyncio.to_thread(gallery_index.changes, since)
+        return {{
+            "images": images,
+            "deleted": deleted,
+            "seq": seq,
+            "reset": reset
+        }}
+    except Exception as e:
+        return {{"images": [], "deleted": [], "seq": since, "reset": True}}
+
+IMMUTABLE_CACHE = "public, max-age=31536000, immutable"
+
+def file_version(size, mtime):
+    """Token that changes whenever a file is rewritten - the ?v= of gallery URLs and their ETag"""
+    return f"{{int(size):x}}-{{int(mtime * 1000):x}}"
+
+def is_not_modified(request, etag, mtime):
+    """True when the phone's cached copy is still current (If-None-Match wins over If-Modified-Since)"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{{etag}}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def cached_file_response(request, path, etag, mtime, immutable=False, media_type=None, headers=None):
+    """FileResponse with validators, or a bodiless 304 when the phone already has it.
+
+    Content-addressed URLs are cached for good; everything else must revalidate,
+    which costs one round trip and no body while the file is unchanged.
+    """
+    headers = {{
+        **(headers or {{}}),
+        "ETag": etag,
+        "Last-Modified": formatdate(mtime, usegmt=True),
+        "Cache-Control": IMMUTABLE_CACHE if immutable else "no-cache"
+    }}
+    if is_not_modified(request, etag, mtime):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type=media_type, headers=headers)
+
+@app.get("/api/gallery/thumb/{{image_id:path}}")
+async def get_thumbnail(image_id: str, request: Request, w: int = THUMB_DEFAULT_WIDTH, v: str = ""):
+    return await get_gallery_image(
+        request, image_id, thumbnail=True, width=thumb_width(w),
+        fmt=thumb_format(request.headers.get("accept")), version=v
+    )
+
+@app.get("/api/gallery/full/{{image_id:path}}")
+async def get_full_image(image_id: str, request: Request, v: str = ""):
+    return await get_gallery_image(request, image_id, thumbnail=False, version=v)
+
+async def get_gallery_image(request: Request, image_id: str, thumbnail: bool = False,
+                            width: int = THUMB_DEFAULT_WIDTH, fmt: str = "jpeg", version: str = ""):
+    try:
+        image_path = await asyncio.to_thread(resolve_gallery_id, image_id)
         
         if not image_path:
             raise HTTPException(status_code=404, detail="Image not found")
         
+        stat = image_path.stat()
+        current = file_version(stat.st_size, stat.st_mtime)
+        # Only a URL naming the current version may be cached forever
+        immutable = version == current
+        
         if thumbnail:
+            # The cache key already names source, size and encoding, so a 304 needs no thumbnail at all
+            etag = f'"{{Path(thumbnail_cache.key(image_path, stat, width, fmt)).stem}}"'
+            if is_not_modified(request, etag, stat.st_mtime):
+                return cached_file_response(request, None, etag, stat.st_mtime, immutable, headers={{"Vary": "Accept"}})
             try:
-                with Image.open(image_path) as img:
-                    if img.mode in ("RGBA", "P"):
-                        img = img.convert("RGB")
-                    
-                    img.thumbnail((300, 300), Image.Resampling.LANCZOS)
-                    
-                    img_buffer = BytesIO()
-                    img.save(img_buffer, format='JPEG', quality=85)
-                    img_buffer.seek(0)
-                    
-                    return Response(
-                        content=img_buffer.getvalue(),
-                        media_type="image/jpeg"
-                    )
+                return cached_file_response(
+                    request,
+                    await thumbnail_cache.get(image_path, width, fmt),
+                    etag, stat.st_mtime, immutable,
+                    media_type=THUMB_FORMATS[fmt]["media_type"],
+                    headers={{"Vary": "Accept"}}
+                )
             except Exception as e:
-                pass
+                print(f"Error creating thumbnail for {{image_path}}: {{e}}")
+                if is_video(image_path):
+                    raise HTTPException(status_code=404, detail="No poster frame for this video")
         
-        return FileResponse(
-            image_path,
-            media_type="image/png" if image_path.suffix.lower() == '.png' else "image/jpeg"
+        # FileResponse answers Range requests, so phones can seek inside long clips
+        return cached_file_response(
+            request, image_path, f'"{{current}}"', stat.st_mtime, immutable,
+            media_type=gallery_media_type(image_path)
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error serving image: {{str(e)}}")
 
@@ -1122,104 +4363,344 @@ async def generate_image(request: GenerateRequest):
     
     try:
         workflow = create_workflow(request)
+        backend, prompt_ids = await dispatch_workflows(required_checkpoint(request), [workflow])
         
-        response = requests.post(
-            f"http://{{COMFYUI_HOST}}:{{COMFYUI_PORT}}/prompt",
-            json={{"prompt": workflow}},
-            timeout=30
-        )
+        jobs[job_id] = {{
+            "status": "processing",
+            "comfy_prompt_id": prompt_ids[0],
+            "backend": backend.name,
+            "steps": request.steps,
+            "submitted": time.time()
+        }}
         
-        if response.status_code != 200:
-            raise HTTPException(status_code=500, detail=f"ComfyUI error: {{response.text}}")
+        return {{"job_id": job_id, "message": "Generation started", "backend": backend.name}}
         
-        comfy_response = response.json()
+    except HTTPException:
+        raise
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=500, detail="ComfyUI connection timeout")
+    except httpx.ConnectError:
+        raise HTTPException(status_code=500, detail="Cannot connect to ComfyUI - is it running?")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/generate/batch")
+async def generate_batch(request: BatchRequest):
+    # Checked before planning - expanding a huge request would block the event loop
+    total_images = batch_image_count(request)
+    if total_images > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f"Batch of {{total_images}} images exceeds the limit of {{BATCH_MAX_IMAGES}}")
+    plan = plan_batch(request)
+    
+    job_id = str(uuid.uuid4())
+    
+    try:
+        # ComfyUI queues prompts in arrival order, so the whole batch goes to one backend in order
+        workflows = [create_workflow(params, batch_size=size) for params, size in plan]
+        backend, prompt_ids = await dispatch_workflows(required_checkpoint(request), workflows)
         
         jobs[job_id] = {{
             "status": "processing",
-            "comfy_prompt_id": comfy_response["prompt_id"],
-            "params": request.dict()
+            "comfy_prompt_ids": prompt_ids,
+            "backend": backend.name,
+            "steps": request.steps,
+            "expected_images": total_images,
+            "submitted": time.time()
         }}
         
-        return {{"job_id": job_id, "message": "Generation started"}}
+        return {{
+            "job_id": job_id,
+            "message": "Batch started",
+            "backend": backend.name,
+            "prompts": len(prompt_ids),
+            "images": total_images
+        }}
         
-    except requests.exceptions.Timeout:
+    except HTTPException:
+        raise
+    except httpx.TimeoutException:
         raise HTTPException(status_code=500, detail="ComfyUI connection timeout")
-    except requests.exceptions.ConnectionError:
+    except httpx.ConnectError:
         raise HTTPException(status_code=500, detail="Cannot connect to ComfyUI - is it running?")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def job_prompt_ids(job):
+    """ComfyUI prompt ids behind a job - batches have several, single jobs one"""
+    return job.get("comfy_prompt_ids") or [job["comfy_prompt_id"]]
+
+def output_images(history_entry):
+    """Saved images of a finished prompt, falling back to previews if nothing was saved"""
+    images = []
+    for node_id, output in history_entry.get("outputs", {{}}).items():
+        images.extend(output.get("images", []))
+    saved = [image for image in images if image.get("type", "output") == "output"]
+    return saved or images
+
+async def prompt_state(job, prompt_id):
+    """Where one ComfyUI prompt of a job stands, as (state, detail).
+
+    done -> list of images, failed -> error message, running -> None,
+    queued -> queue position or None if ComfyUI has not listed it yet.
+    """
+    finished = job.get("outputs", {{}})
+    if prompt_id in finished:
+        return "done", finished[prompt_id]
+    
+    backend = comfy_backends.of(job)
+    snapshot = backend.snapshot
+    history_entry = snapshot.history.get(prompt_id)
+    running = prompt_id in snapshot.running or prompt_id == backend.events.current_prompt
+    queued = running or prompt_id in snapshot.pending
+    submitted_since_snapshot = job.get("submitted", 0) >= snapshot.updated
+    
+    if history_entry is None and not queued and not submitted_since_snapshot:
+        history_entry = await snapshot.lookup_history(prompt_id)
+    
+    if history_entry is not None:
+        if history_entry.get("status", {{}}).get("status_str") == "error":
+            return "failed", "Generation failed in ComfyUI"
+        images = output_images(history_entry)
+        if images:
+            return "done", images
+    
+    if running:
+        return "running", None
+    if prompt_id in snapshot.pending:
+        return "queued", snapshot.pending.index(prompt_id) + 1
+    if submitted_since_snapshot:
+        # Accepted by ComfyUI but not in a snapshot yet
+        return "queued", None
+    return "failed", "Job not found in ComfyUI queue"
+
 @app.get("/api/status/{{job_id}}")
 async def get_job_status(job_id: str):
     if job_id not in jobs:
         raise HTTPException(status_code=404, detail="Job not found")
     
     job = jobs[job_id]
+    if job["status"] == "completed" and "output_image" in job:
+        return {{"status": "completed", "progress": 100, "images": len(job.get("output_images", [job["output_image"]]))}}
     
+    backend = comfy_backends.of(job)
     try:
-        prompt_id = job["comfy_prompt_id"]
+        if not backend.snapshot.updated:
+            await backend.snapshot.sync()
+        if backend.snapshot.error and not backend.snapshot.updated:
+            raise Exception(f"Cannot reach ComfyUI: {{backend.snapshot.error}}")
+        
+        prompt_ids = job_prompt_ids(job)
+        states = [await prompt_state(job, prompt_id) for prompt_id in prompt_ids]
+        
+        outputs = dict(job.get("outputs", {{}}))
+        for prompt_id, (state, detail) in zip(prompt_ids, states):
+            if state == "done" and prompt_id not in outputs:
+                outputs[prompt_id] = detail
+        if len(prompt_ids) > 1 and len(outputs) != len(job.get("outputs", {{}})):
+            # Journal each finished batch prompt so a restart doesn't refetch it
+            jobs.update(job_id, outputs=outputs)
+        
+        if all(state in ("done", "failed") for state, detail in states):
+            images = [image for prompt_id in prompt_ids for image in outputs.get(prompt_id, [])]
+            if not images:
+                jobs.update(job_id, status="failed")
+                if job.get("cancelled"):
+                    return {{"status": "failed", "error": "Cancelled", "cancelled": True}}
+                return {{"status": "failed", "error": next(detail for state, detail in states if state == "failed")}}
+            jobs.update(job_id, status="completed", output_image=images[0], output_images=images)
+            failed = sum(1 for state, detail in states if state == "failed")
+            result = {{"status": "completed", "progress": 100, "images": len(images)}}
+            if failed:
+                result["failed_prompts"] = failed
+            return result
         
-        history_response = requests.get(f"http://{{COMFYUI_HOST}}:{{COMFYUI_PORT}}/history/{{prompt_id}}", timeout=10)
+        if len(prompt_ids) > 1:
+            return batch_status(job, prompt_ids, states)
         
-        if history_response.status_code == 200:
-            history = history_response.json()
+        state, detail = states[0]
+        prompt_id = prompt_ids[0]
+        if state == "running":
+            if "start_time" not in job:
+                jobs.update(job_id, start_time=time.time())
             
-            if prompt_id in history:
-                history_entry = history[prompt_id]
-                outputs = history_entry.get("outputs", {{}})
-                
-                if history_entry.get("status", {{}}).get("status_str") == "error":
-                    job["status"] = "failed"
-                    return {{"status": "failed", "error": "Generation failed in ComfyUI"}}
-                
-                for node_id, output in outputs.items():
-                    if "images" in output:
-                        image_info = output["images"][0]
-                        job["status"] = "completed"
-                        job["output_image"] = image_info
-                        return {{"status": "completed", "progress": 100}}
-        
-        queue_response = requests.get(f"http://{{COMFYUI_HOST}}:{{COMFYUI_PORT}}/queue", timeout=10)
-        if queue_response.status_code == 200:
-            queue_data = queue_response.json()
+            elapsed = time.time() - job["start_time"]
+            live = backend.events.live_progress(prompt_id)
+            if live:
+                return {{"status": "processing", **live, "elapsed_time": int(elapsed)}}
             
-            for item in queue_data.get("queue_running", []):
-                if len(item) > 1 and item[1] == prompt_id:
-                    if "start_time" not in job:
-                        job["start_time"] = __import__('time').time()
-                    
-                    elapsed = __import__('time').time() - job["start_time"]
-                    expected_steps = job.get("params", {{}}).get("steps", 10)
-                    estimated_total_time = expected_steps * 1.0
-                    
-                    if elapsed < estimated_total_time:
-                        progress = int((elapsed / estimated_total_time) * 95)
-                    else:
-                        progress = 95
-                    
-                    return {{
-                        "status": "processing",
-                        "progress": max(15, progress),
-                        "elapsed_time": int(elapsed)
-                    }}
+            expected_steps = job.get("steps", 10)
+            estimated_total_time = expected_steps * 1.0
             
-            for idx, item in enumerate(queue_data.get("queue_pending", [])):
-                if len(item) > 1 and item[1] == prompt_id:
-                    return {{
-                        "status": "queued",
-                        "progress": 5,
-                        "queue_position": idx + 1
-                    }}
+            if elapsed < estimated_total_time:
+                progress = int((elapsed / estimated_total_time) * 95)
+            else:
+                progress = 95
+            
+            return {{
+                "status": "processing",
+                "progress": max(15, progress),
+                "elapsed_time": int(elapsed)
+            }}
         
-        job["status"] = "failed"
-        return {{"status": "failed", "error": "Job not found in ComfyUI queue"}}
+        if detail is not None:
+            return {{"status": "queued", "progress": 5, "queue_position": detail}}
+        return {{"status": "queued", "progress": 5}}
         
     except Exception as e:
-        job["status"] = "failed"
+        jobs.update(job_id, status="failed")
         return {{"status": "failed", "error": str(e)}}
 
+def batch_status(job, prompt_ids, states):
+    """Overall progress of a batch that is still running - finished prompts plus the live one"""
+    finished = sum(1 for state, detail in states if state in ("done", "failed"))
+    fraction = 0.0
+    status = "processing" if finished else "queued"
+    events = comfy_backends.of(job).events
+    for prompt_id, (state, detail) in zip(prompt_ids, states):
+        if state == "running":
+            status = "processing"
+            live = events.live_progress(prompt_id)
+            if live:
+                fraction = live["progress"] / 100
+    
+    result = {{
+        "status": status,
+        "progress": max(5, int((finished + fraction) / len(prompt_ids) * 100)),
+        "completed_prompts": finished,
+        "total_prompts": len(prompt_ids),
+        "images": sum(len(detail) for state, detail in states if state == "done")
+    }}
+    positions = [detail for state, detail in states if state == "queued" and detail is not None]
+    if status == "queued" and positions:
+        result["queue_position"] = min(positions)
+    return result
+
+def sse_message(payload, event=None):
+    prefix = f"event: {{event}}\\n" if event else ""
+    return f"{{prefix}}data: {{json.dumps(payload)}}\\n\\n"
+
+async def job_event_status(job_id, event):
+    """Translate a ComfyUI event into the status payload the page understands"""
+    event_type = event["type"]
+    prompt_ids = job_prompt_ids(jobs[job_id])
+    backend = comfy_backends.of(jobs[job_id])
+
+    if len(prompt_ids) > 1 and event_type in ("progress", "execution_start"):
+        # Batch progress spans prompts, the snapshot and bridge already know enough
+        return await get_job_status(job_id)
+    if event_type == "progress":
+        live = backend.events.live_progress(prompt_ids[0])
+        if live:
+            return {{"status": "processing", **live}}
+    elif event_type == "execution_start":
+        return {{"status": "processing", "progress": 0}}
+    elif event_type in ("executing", "execution_cached", "executed"):
+        if event["data"].get("node") is not None or event_type == "execution_cached":
+            return None
+        await backend.snapshot.sync()
+        return await get_job_status(job_id)
+    elif event_type in ("execution_success", "execution_error", "execution_interrupted", "resync"):
+        await backend.snapshot.sync()
+        return await get_job_status(job_id)
+    return None
+
+@app.get("/api/events/{{job_id}}")
+async def stream_job_events(job_id: str):
+    if job_id not in jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    prompt_ids = job_prompt_ids(jobs[job_id])
+    bridge = comfy_backends.of(jobs[job_id]).events
+
+    async def events():
+        # Subscribe before the first status check so no event slips in between
+        events_queue = bridge.subscribe(prompt_ids)
+        try:
+            status = await get_job_status(job_id)
+            yield sse_message(status)
+            last_sent = preview_sent = time.monotonic()
+            preview_frame = 0
+            while status["status"] not in ("completed", "failed"):
+                previews = PREVIEW_FPS and status["status"] == "processing"
+                # While it runs, wake often enough to pass previews on at PREVIEW_FPS
+                timeout = min(SSE_KEEPALIVE_INTERVAL, 1 / PREVIEW_FPS) if previews else SSE_KEEPALIVE_INTERVAL
+                try:
+                    event = await asyncio.wait_for(events_queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    event = None
+                if event:
+                    update = await job_event_status(job_id, event)
+                    if update:
+                        status = update
+                        yield sse_message(status)
+                        last_sent = time.monotonic()
+                if previews and time.monotonic() - preview_sent >= 1 / PREVIEW_FPS:
+                    preview = await bridge.latest_preview(prompt_ids, preview_frame)
+                    if preview:
+                        preview_frame, image = preview
+                        yield sse_message({{"image": image}}, event="preview")
+                        last_sent = preview_sent = time.monotonic()
+                if time.monotonic() - last_sent >= SSE_KEEPALIVE_INTERVAL:
+                    yield ": keep-alive\\n\\n"
+                    last_sent = time.monotonic()
+        finally:
+            bridge.unsubscribe(prompt_ids, events_queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={{"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}}
+    )
+
+@app.post("/api/cancel/{{job_id}}")
+async def cancel_job(job_id: str):
+    """Drop a job's queued prompts from ComfyUI and interrupt the one that is running"""
+    if job_id not in jobs:
+        raise HTTPException(status_code=404, detail="Job not found")
+    job = jobs[job_id]
+    if job["status"] in ("completed", "failed"):
+        return {{"job_id": job_id, "status": job["status"]}}
+
+    jobs.update(job_id, cancelled=True)
+    backend = comfy_backends.of(job)
+    await backend.snapshot.sync()
+    prompt_ids = [prompt_id for prompt_id in job_prompt_ids(job) if prompt_id not in job.get("outputs", {{}})]
+    running = [prompt_id for prompt_id in prompt_ids
+               if prompt_id in backend.snapshot.running or prompt_id == backend.events.current_prompt]
+    pending = [prompt_id for prompt_id in prompt_ids if prompt_id not in running]
+    try:
+        # Queued prompts go first, so ComfyUI can't move on to the next one of a batch after the interrupt
+        if pending:
+            await backend.client.post("/queue", json={{"delete": pending}}, timeout=10)
+        for prompt_id in running:
+            # Builds that know prompt_id only interrupt that prompt, older ones whatever runs now
+            await backend.client.post("/interrupt", json={{"prompt_id": prompt_id}}, timeout=10)
+    except httpx.TimeoutException:
+        raise HTTPException(status_code=504, detail="ComfyUI request timeout")
+    except httpx.ConnectError:
+        raise HTTPException(status_code=503, detail="Cannot connect to ComfyUI")
+    backend.snapshot.poke()
+    # Deleted prompts never get a ComfyUI event, so open streams are told to look again
+    for prompt_id in pending:
+        backend.events.publish(prompt_id, {{"type": "resync", "data": {{}}}})
+    return {{"job_id": job_id, "status": "cancelling"}}
+
+def local_output_path(backend, image_info):
+    """Where a backend's output image sits on this disk, or None if it can't be read directly"""
+    if backend.output_dir is None or image_info.get("type", "output") != "output":
+        return None
+    try:
+        root = backend.output_dir.resolve()
+        path = (root / image_info.get("subfolder", "") / image_info["filename"]).resolve()
+    except (OSError, KeyError):
+        return None
+    # Never follow a subfolder or filename out of the output folder
+    if root not in path.parents or not path.is_file():
+        return None
+    return path
+
 @app.get("/api/image/{{job_id}}")
-async def get_image(job_id: str):
+async def get_image(job_id: str, request: Request, index: int = 0):
     if job_id not in jobs:
         raise HTTPException(status_code=404, detail="Job not found")
     
@@ -1228,50 +4709,77 @@ async def get_image(job_id: str):
     if job["status"] != "completed" or "output_image" not in job:
         raise HTTPException(status_code=404, detail="Image not ready")
     
-    image_info = job["output_image"]
+    images = job.get("output_images", [job["output_image"]])
+    if not 0 <= index < len(images):
+        raise HTTPException(status_code=404, detail="Image index out of range")
+    image_info = images[index]
+    headers = {{"Content-Disposition": f"inline; filename={{image_info['filename']}}"}}
+    
+    backend = comfy_backends.of(job)
+    local_path = local_output_path(backend, image_info)
+    if local_path:
+        # Straight off the disk - FileResponse hands the file to sendfile. A job's
+        # outputs never change once it completed, so the URL is safe to cache for good
+        stat = local_path.stat()
+        return cached_file_response(
+            request, local_path, f'"{{file_version(stat.st_size, stat.st_mtime)}}"', stat.st_mtime,
+            immutable=True, media_type=gallery_media_type(local_path), headers=headers
+        )
     
     try:
-        image_path = f"http://{{COMFYUI_HOST}}:{{COMFYUI_PORT}}/view"
         params = {{
             "filename": image_info["filename"],
             "subfolder": image_info.get("subfolder", ""),
             "type": image_info.get("type", "output")
         }}
         
-        image_response = requests.get(image_path, params=params, timeout=30)
-        
-        if image_response.status_code == 200:
-            return Response(
-                content=image_response.content,
-                media_type="image/png",
-                headers={{"Content-Disposition": f"inline; filename={{image_info['filename']}}"}}
-            )
-        else:
+        upstream = await backend.client.send(
+            backend.client.build_request("GET", "/view", params=params, timeout=30),
+            stream=True
+        )
+        if upstream.status_code != 200:
+            await upstream.aclose()
             raise HTTPException(status_code=404, detail="Image not found in ComfyUI")
-            
+        
+        if "content-length" in upstream.headers:
+            headers["Content-Length"] = upstream.headers["content-length"]
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            media_type=upstream.headers.get("content-type", "image/png"),
+            headers=headers,
+            background=BackgroundTask(upstream.aclose)
+        )
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get image: {{str(e)}}")
 
 @app.get("/api/health")
 async def health_check():
-    try:
-        response = requests.get(f"http://{{COMFYUI_HOST}}:{{COMFYUI_PORT}}/system_stats", timeout=5)
-        if response.status_code == 200:
-            return {{"status": "healthy", "comfyui": "connected"}}
-        else:
-            return {{"status": "degraded", "comfyui": "disconnected"}}
-    except:
-        return {{"status": "unhealthy", "comfyui": "unreachable"}}
+    # Straight from the queue snapshots, so a hung backend can't stall the answer
+    backends = [backend.describe() for backend in comfy_backends.backends.values()]
+    reachable = sum(1 for backend in backends if backend["healthy"])
+    if reachable == len(backends):
+        status = "healthy"
+    elif reachable:
+        status = "degraded"
+    else:
+        status = "unhealthy"
+    return {{"status": status, "comfyui": "connected" if reachable else "unreachable", "backends": backends}}
 
 if __name__ == "__main__":
     print(f"Starting ComfyUI Mobile API...")
-    print(f"ComfyUI connection: {{COMFYUI_HOST}}:{{COMFYUI_PORT}}")
-    print(f"Web UI: http://0.0.0.0:8080")
-    print(f"Mobile access: http://[your-pc-ip]:8080")
-    print(f"Gallery path: {{COMFYUI_OUTPUT_DIR}}")
+    for name, backend in COMFYUI_BACKENDS.items():
+        print(f"ComfyUI backend '{{name}}': {{backend['url']}}")
+    scheme = "https" if SSL_CERTFILE else "http"
+    print(f"Web UI: {{scheme}}://0.0.0.0:8080")
+    print(f"Mobile access: {{scheme}}://[your-pc-ip]:8080")
+    for name, root in GALLERY_ROOTS.items():
+        print(f"Gallery root '{{name}}': {{root}}")
     print(f"Make sure ComfyUI is running!")
     
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    uvicorn.run(app, host="0.0.0.0", port=8080, ssl_certfile=SSL_CERTFILE, ssl_keyfile=SSL_KEYFILE)
 '''
     
     return script_content
@@ -33,9 +33,13 @@ def main():
     packages = [
         ("fastapi", "fastapi"),
         ("uvicorn", "uvicorn"),
-        ("requests", "requests"),
+        ("httpx", "httpx"),
+        ("websockets", "websockets"),
         ("pydantic", "pydantic"),
         ("pillow", "PIL"),  # Pillow imports as PIL
+        ("watchdog", "watchdog"),
+        ("numpy", "numpy"),
+        ("brotli", "brotli"),
     ]
     
     installed = []
@@ -22,9 +22,13 @@ def main():
     packages = [
         "fastapi",
         "uvicorn",
-        "requests",
+        "httpx",
+        "websockets",
         "pydantic",
-        "pillow"
+        "pillow",
+        "watchdog",
+        "numpy",
+        "brotli"
     ]
     
     # Track installation results
@@ -0,0 +1,29 @@
+import os
+import sys
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from comfyui_setup_gui import generate_configured_script
+
+@pytest.fixture(scope="session")
+def api(tmp_path_factory):
+    """The generated mobile API script, imported from a scratch ComfyUI folder"""
+    work_dir = tmp_path_factory.mktemp("comfyui")
+    output_dir = work_dir / "output"
+    output_dir.mkdir()
+    script_path = work_dir / "comfyui_mobile_api.py"
+    script_path.write_text(generate_configured_script(work_dir, output_dir), encoding="utf-8")
+
+    # The script creates its cache and output folders next to where it runs
+    previous = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        spec = importlib.util.spec_from_file_location("comfyui_mobile_api", script_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(previous)
+    return module
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+from PIL import Image, PngImagePlugin
+
+def save_jpeg_with_user_comment(path, comment):
+    exif = Image.Exif()
+    exif.get_ifd(0x8769)[0x9286] = b"ASCII\x00\x00\x00" + comment.encode("utf-8")
+    Image.new("RGB", (32, 24)).save(path, "JPEG", exif=exif)
+
+def save_png_with_prompt(path, text):
+    prompt = {"3": {"class_type": "KSampler", "inputs": {"steps": 20, "cfg": 7.0, "sampler_name": "euler"}},
+              "6": {"class_type": "CLIPTextEncode", "inputs": {"text": text}}}
+    info = PngImagePlugin.PngInfo()
+    info.add_text("prompt", json.dumps(prompt))
+    Image.new("RGB", (64, 64)).save(path, pnginfo=info)
+
+@pytest.fixture
+def index(api, tmp_path, monkeypatch):
+    for path in api.COMFYUI_OUTPUT_DIR.iterdir():
+        path.unlink()
+    monkeypatch.setattr(api, "metadata_cache", api.MetadataCache(tmp_path / "metadata.db", 1000))
+    return api.GalleryIndex(tmp_path / "gallery.db")
+
+@pytest.mark.parametrize("comment", ["[1, 2]", '"text"', "42", "null"])
+def test_user_comment_json_that_is_not_an_object_holds_no_settings(api, comment):
+    assert api.settings_from_metadata(None, b"ASCII\x00\x00\x00" + comment.encode()) is None
+
+def test_non_object_user_comment_does_not_empty_the_gallery(api, index):
+    save_jpeg_with_user_comment(api.COMFYUI_OUTPUT_DIR / "odd.jpg", "[1, 2]")
+    save_png_with_prompt(api.COMFYUI_OUTPUT_DIR / "castle.png", "a castle")
+
+    index.reconcile()
+    entries, _ = index.page(None, 20)
+
+    assert sorted(entry["filename"] for entry in entries) == ["castle.png", "odd.jpg"]
+    assert index.conn.execute("SELECT COUNT(*) FROM images WHERE indexed = 0").fetchone()[0] == 0
+    assert [row[0] for row in index.conn.execute("SELECT name FROM images WHERE prompt = 'a castle'")] == ["castle.png"]
+
+def test_unreadable_metadata_skips_only_that_file(api, index, monkeypatch):
+    save_png_with_prompt(api.COMFYUI_OUTPUT_DIR / "bad.png", "broken")
+    save_png_with_prompt(api.COMFYUI_OUTPUT_DIR / "good.png", "fine")
+    lookup = api.metadata_cache.lookup
+
+    def failing_lookup(path, mtime, size):
+        if path.endswith("bad.png"):
+            raise ValueError("unexpected metadata")
+        return lookup(path, mtime, size)
+
+    monkeypatch.setattr(api.metadata_cache, "lookup", failing_lookup)
+    index.reconcile()
+    entries, _ = index.page(None, 20)
+
+    assert sorted(entry["filename"] for entry in entries) == ["bad.png", "good.png"]
+    assert index.conn.execute("SELECT COUNT(*) FROM images WHERE indexed = 0").fetchone()[0] == 0
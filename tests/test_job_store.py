@@ -0,0 +1,36 @@
+import json
+import time
+
+def write_journal(path, now):
+    records = [
+        {"id": "expired", "status": "completed", "submitted": now - 8 * 3600, "finished": now - 7 * 3600},
+        {"id": "stale", "status": "processing", "submitted": now - 30 * 3600},
+        {"id": "recent", "status": "completed", "submitted": now - 120, "finished": now - 60},
+        {"id": "running", "status": "processing", "submitted": now - 30},
+    ]
+    path.write_text("".join(json.dumps(record) + "\n" for record in records), encoding="utf-8")
+
+def open_store(api, path):
+    return api.JobStore(path, api.JOB_MAX_ENTRIES, api.JOB_TTL, api.JOB_STALE_AGE)
+
+def test_journal_with_expired_and_stale_jobs_loads(api, tmp_path):
+    journal = tmp_path / "jobs.jsonl"
+    write_journal(journal, time.time())
+
+    store = open_store(api, journal)
+    try:
+        assert sorted(store.jobs) == ["recent", "running"]
+        store["new"] = {"status": "processing", "submitted": time.time()}
+    finally:
+        store.close()
+
+    reloaded = open_store(api, journal)
+    reloaded.close()
+    assert sorted(reloaded.jobs) == ["new", "recent", "running"]
+
+def test_compacted_journal_has_one_line_per_job(api, tmp_path):
+    journal = tmp_path / "jobs.jsonl"
+    write_journal(journal, time.time())
+
+    open_store(api, journal).close()
+    assert [json.loads(line)["id"] for line in journal.read_text().splitlines()] == ["recent", "running"]